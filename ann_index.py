@@ -0,0 +1,181 @@
+import math
+import logging
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# --- Index Types & Default Parameters ---
+# flat      exact brute-force search (IndexFlatL2), the previous behaviour
+# ivf_flat  inverted file over k-means cells, full vectors; nprobe cells are scanned per query
+# ivf_pq    inverted file with product-quantized vectors; much smaller, approximate distances
+# hnsw      hierarchical navigable small-world graph over full vectors
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+DEFAULT_PARAMS = {
+    "nlist": None,         # IVF cells; None picks ~4*sqrt(n) for the training set
+    "nprobe": 16,          # IVF cells scanned per query
+    "pq_m": 48,            # PQ sub-quantizers; must divide the dimension (768 / 48 = 16)
+    "pq_nbits": 8,         # Bits per PQ code
+    "hnsw_m": 32,          # HNSW neighbours per node
+    "ef_construction": 80,  # HNSW build-time search depth
+    "ef_search": 64,       # HNSW query-time search depth
+}
+
+MIN_POINTS_PER_CENTROID = 39  # Below this FAISS warns that k-means training is unreliable
+
+
+def resolve_params(params=None):
+    """Merges user-supplied parameters over the defaults, ignoring unset (None) values."""
+    resolved = dict(DEFAULT_PARAMS)
+    for key, value in (params or {}).items():
+        if key not in DEFAULT_PARAMS:
+            raise ValueError(f"Unknown index parameter '{key}'. Expected one of {sorted(DEFAULT_PARAMS)}.")
+        if value is not None:
+            resolved[key] = value
+    return resolved
+
+
+def make_index(dim, index_type="flat", num_train=None, **params):
+    """
+    Creates an empty (untrained) FAISS index of the given type.
+    `num_train` is the number of vectors available for training and is used to keep
+    nlist and the PQ codebook size in a range k-means can actually fit.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+    p = resolve_params(params)
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, p["hnsw_m"])
+        index.hnsw.efConstruction = p["ef_construction"]
+        index.hnsw.efSearch = p["ef_search"]
+        return index
+
+    nlist = p["nlist"]
+    if nlist is None:
+        nlist = int(4 * math.sqrt(num_train or 1))
+    if num_train:
+        nlist = min(nlist, max(1, num_train // MIN_POINTS_PER_CENTROID))
+    quantizer = faiss.IndexFlatL2(dim)
+
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    else:
+        if dim % p["pq_m"] != 0:
+            raise ValueError(f"pq_m={p['pq_m']} must divide the vector dimension {dim}.")
+        nbits = p["pq_nbits"]
+        if num_train:
+            # Each sub-quantizer trains 2**nbits centroids on the same training set
+            nbits = max(1, min(nbits, int(math.log2(max(2, num_train // MIN_POINTS_PER_CENTROID)))))
+            if nbits != p["pq_nbits"]:
+                logger.warning(f"Only {num_train} training vectors; reducing pq_nbits to {nbits}.")
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, p["pq_m"], nbits)
+
+    index.nprobe = min(p["nprobe"], nlist)
+    return index
+
+
+def build_index(vectors, index_type="flat", **params):
+    """Creates an index of the given type, trains it on `vectors` if needed and adds them."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = make_index(vectors.shape[1], index_type, num_train=len(vectors), **params)
+    if not index.is_trained:
+        if not len(vectors):
+            raise ValueError(f"Cannot train a '{index_type}' index without any vectors.")
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Adjusts query-time parameters of a (loaded) index in place."""
+    index = faiss.downcast_index(index)
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def row_selector(mask):
+    """
+    Builds an IDSelector admitting the rows where the boolean `mask` is True. Returns the
+    selector and its bitmap; the bitmap must be kept alive for as long as the selector is used.
+    """
+    bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    return faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), bitmap
+
+
+def search_parameters(index, selector):
+    """Per-query search parameters restricted to `selector`, keeping the index's nprobe/efSearch."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def index_kind(index):
+    """Returns which of INDEX_TYPES an index is."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def is_lossy(index):
+    """True if vectors reconstructed from the index are only approximations."""
+    return index_kind(index) == "ivf_pq"
+
+
+def reconstruct_all(index):
+    """Returns every stored vector as a matrix, in index order."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def enable_reconstruct(index):
+    """
+    Builds the row -> inverted list map an IVF index needs to reconstruct single rows (8 bytes
+    per vector). It modifies the index, so call it once after loading, before any search.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.NoMap:
+        index.make_direct_map()
+
+
+def reconstruct_rows(index, rows):
+    """Returns the stored vectors of some rows as a matrix, in the order given (see enable_reconstruct)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.NoMap:
+        raise ValueError("IVF index has no direct map; call enable_reconstruct once after loading it.")
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(rows)
+
+
+def convert_index(index, index_type="flat", **params):
+    """Rebuilds an index as another type, preserving vector order (and thus docstore mapping)."""
+    if is_lossy(index):
+        logger.warning("Converting from a PQ index uses approximate vectors. Run a full rebuild for best recall.")
+    return build_index(reconstruct_all(index), index_type, **params)
+
+
+def index_memory_bytes(index):
+    """Size of the serialized index, a close proxy for its in-memory footprint."""
+    return int(faiss.serialize_index(index).nbytes)
@@ -1,25 +1,35 @@
 # main.py
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional, Union
+from contextlib import asynccontextmanager
+import asyncio
+from collections import Counter
+import hashlib
+import importlib
+import json
 
 # --- Imports from App 1 (Summarizer) ---
-import fitz  # PyMuPDF for PDF handling
-import faiss
-import numpy as np
-import ollama
-from gtts import gTTS
+# fitz (PyMuPDF), faiss, gtts and llm_providers are imported where they are used, and warmed up in
+# the background at startup (see load_pdf_tools), so importing this module stays fast.
 import uuid
 from pathlib import Path
 import logging
 
 # --- Imports from App 2 (RAG/Risk) ---
-from rag_pipeline import RAGPipeline
-from risk_assessor import RiskAssessor
-from test import text_to_pdf
+# rag_pipeline (LangChain, Gemini) and test (reportlab) are imported lazily as well
+from concurrency import QueueFullError, SingleFlight
+from warmup import Component, NotReadyError
+from ttl_cache import normalize_query
+import contract_metadata
+import risk_profile
+from document_index import DocumentIndexCache, build_document_index, load_pages, save_pages
+from risk_assessor import DEFAULT_RISK, RISK_LEVELS, RiskAssessor
+import chunker
 # from pdf_processor import extract_text_from_pdf # This is now handled by PDFProcessor class
 import io
 import os
@@ -31,8 +41,15 @@ import time
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Heavy components load in the background once the server is up; see section 2
+@asynccontextmanager
+async def lifespan(app):
+    for component in COMPONENTS:
+        component.start()
+    yield
+
 # Initialize FastAPI App and add CORS middleware (from App 2)
-app = FastAPI(title="Integrated Legal AI Assistant", version="2.0.0")
+app = FastAPI(title="Integrated Legal AI Assistant", version="2.0.0", lifespan=lifespan)
 
 origins = [
     "*"  # Allows all origins for development. Restrict this in production!
@@ -59,55 +76,49 @@ class PDFProcessor:
     """Class to handle PDF processing, summarization, and TTS"""
 
     @staticmethod
-    def extract_text_from_pdf(pdf_content: bytes) -> str:
-        """Extract text from PDF file"""
+    def extract_pages(pdf_content: bytes) -> list:
+        """Extract the text of each page of a PDF file"""
+        import fitz  # PyMuPDF for PDF handling
         try:
             doc = fitz.open(stream=pdf_content, filetype="pdf")
-            text = "\n".join(page.get_text("text") for page in doc)
+            pages = [page.get_text("text") for page in doc]
             doc.close()
-            return text
+            return pages
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {e}")
             raise HTTPException(status_code=400, detail="Error processing PDF file")
 
     @staticmethod
-    def split_text(text: str, chunk_size: int = 500) -> list:
-        """Split text into chunks"""
-        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    def extract_text_from_pdf(pdf_content: bytes) -> str:
+        """Extract text from PDF file"""
+        return "\n".join(PDFProcessor.extract_pages(pdf_content))
 
     @staticmethod
-    def store_embeddings(text_chunks: list):
-        """Store embeddings using FAISS (placeholder implementation)"""
-        # Note: This is a placeholder. A real implementation would generate embeddings.
-        dimension = 768  # Adjust based on the embedding model
-        index = faiss.IndexFlatL2(dimension)
-        stored_chunks = text_chunks
-        return index, stored_chunks
+    def open_pdf(pdf_content: bytes):
+        """Open a PDF for reading page by page"""
+        import fitz  # PyMuPDF for PDF handling
+        try:
+            return fitz.open(stream=pdf_content, filetype="pdf")
+        except Exception as e:
+            logger.error(f"Error opening PDF: {e}")
+            raise HTTPException(status_code=400, detail="Error processing PDF file")
 
     @staticmethod
-    def retrieve_top_chunks(query: str, stored_chunks: list, top_k: int = 3) -> str:
-        """Retrieve top text chunks (simple implementation)"""
-        # Note: This is a placeholder. A real implementation would use the FAISS index.
-        return " ".join(stored_chunks[:top_k])
+    def split_text(text: str, chunk_size: int = 500, chunk_overlap: int = 0) -> list:
+        """Split text into chunks on section and paragraph boundaries"""
+        return chunker.split_text(text, chunk_size, chunk_overlap)
 
     @staticmethod
-    def summarize_text(text: str) -> str:
-        """Summarize text using Ollama"""
-        try:
-            response = ollama.chat(
-                model="mistral",
-                messages=[{"role": "user", "content": f"Summarize this text in a clear and concise way: {text}"}]
-            )
-            return response['message']['content']
-        except Exception as e:
-            logger.error(f"Error summarizing text: {e}")
-            # Fallback summary if Ollama is not available
-            sentences = text.split('. ')
-            return '. '.join(sentences[:3]) + "..." if len(sentences) > 3 else text
+    async def summarize_text(text: str):
+        """Summarize text of any length with the configured summary model (Ollama's mistral by default), map-reduce style"""
+        import llm_providers
+        from summarizer import MapReduceSummarizer
+        return await MapReduceSummarizer(llm_providers.summary_model()).summarize(text)
 
     @staticmethod
     def text_to_speech(text: str) -> str:
         """Convert text to speech and return filename"""
+        from gtts import gTTS
         try:
             tts = gTTS(text=text, lang="en")
             filename = f"{uuid.uuid4()}.mp3"
@@ -118,15 +129,58 @@ class PDFProcessor:
             logger.error(f"Error converting text to speech: {e}")
             raise HTTPException(status_code=500, detail="Error generating audio")
 
-# Initialize all required components
+# Batch evaluation limits
+MAX_BATCH_PROMPTS = 64
+BATCH_GENERATE_CONCURRENCY = int(os.getenv("BATCH_GENERATE_CONCURRENCY", "8"))  # LLM calls in flight per batch
+MAX_CLASSIFY_CLAUSES = int(os.getenv("MAX_CLASSIFY_CLAUSES", "5000"))  # Clauses per /classify call
+MAX_DOCUMENT_PASSAGES = 20  # Passages one document answer can be based on
+
+# Seconds a request waits for a component that is still loading before getting a 503
+READY_WAIT_TIMEOUT = float(os.getenv("READY_WAIT_TIMEOUT", "10"))
+
+def load_rag_pipeline():
+    """Loads the index, embeddings and LLM clients (needs GEMINI_API_KEY and a built index)."""
+    from rag_pipeline import RAGPipeline
+    return RAGPipeline(faiss_index_path="faiss_index")
+
+def load_pdf_tools():
+    """Imports the PDF and speech libraries and builds the summary model so the first upload does not pay for it."""
+    for module in ("fitz", "gtts"):
+        importlib.import_module(module)
+    import llm_providers
+    return llm_providers.summary_model()
+
+# Initialize all required components. The expensive ones are loaded after startup, so a
+# missing key or index only fails the endpoints that need them.
+rag_component = Component("rag_pipeline", load_rag_pipeline, wait_timeout=READY_WAIT_TIMEOUT)
+pdf_tools_component = Component("pdf_tools", load_pdf_tools, wait_timeout=READY_WAIT_TIMEOUT)
+COMPONENTS = (rag_component, pdf_tools_component)
 pdf_processor = PDFProcessor()
-rag_pipeline = RAGPipeline(faiss_index_path="faiss_index")
 risk_assessor = RiskAssessor()
 
+# Identical requests arriving while one is being processed share its result (see SingleFlight)
+evaluate_flights = SingleFlight()
+upload_flights = SingleFlight()
+document_flights = SingleFlight()
+# Vector indexes of uploaded documents, keyed by content hash, for follow-up questions
+document_indexes = DocumentIndexCache()
+
+async def get_rag_pipeline():
+    """Dependency for endpoints that need the RAG pipeline; waits for it to finish loading."""
+    return await rag_component.get()
+
 # --- 3. Pydantic Models for Request Bodies (from App 2) ---
 
+class RetrievalFilter(BaseModel):
+    agreement_type: Optional[Union[str, list[str]]] = None  # e.g. "license" or ["distributor", "reseller"]
+    filer: Optional[str] = None
+    date_from: Optional[str] = None  # ISO date, inclusive
+    date_to: Optional[str] = None
+
 class ClauseRequest(BaseModel):
     prompt: str
+    filter: Optional[RetrievalFilter] = None
+    bypass_cache: bool = False  # Always generate a fresh clause (e.g. for "Re-generate")
 
 class PdfRequest(BaseModel):
     clause: str
@@ -137,6 +191,51 @@ class EvaluationResponse(BaseModel):
     classification: str
     source: str
     feedback_options: list[str]
+    cached: bool = False  # Served from the semantic response cache
+    # Nearest category centroid to the prompt and its retrieved chunks (see clause_classifier.py)
+    semantic_classification: Optional[str] = None
+
+class BatchClauseRequest(BaseModel):
+    prompts: list[str]
+    filter: Optional[RetrievalFilter] = None
+    bypass_cache: bool = False
+
+class BatchEvaluationItem(BaseModel):
+    prompt: str
+    result: Optional[EvaluationResponse] = None
+    error: Optional[str] = None
+
+class BatchEvaluationResponse(BaseModel):
+    results: list[BatchEvaluationItem]
+
+class DocumentInfo(BaseModel):
+    document_id: str  # SHA-256 of the uploaded file
+    pages: int
+    chunks: int
+    cached: bool = False  # The document was already indexed
+    # False when the index exceeds the document cache budget; each question then rebuilds it
+    index_cached: bool = True
+
+class DocumentQuestion(BaseModel):
+    question: str
+    k: int = 4  # Passages the answer is based on
+
+class DocumentPassage(BaseModel):
+    text: str
+    first_page: int
+    last_page: int
+    score: float  # Cosine similarity to the question
+
+class DocumentAnswer(BaseModel):
+    answer: str
+    passages: list[DocumentPassage]
+
+class ClassifyRequest(BaseModel):
+    clauses: list[str]
+
+class ClauseClassification(BaseModel):
+    classification: str
+    score: float  # Cosine similarity to the category's centroid
 
 
 # --- 4. API Endpoints ---
@@ -281,56 +380,510 @@ async def upload_pdf_and_summarize(file: UploadFile = File(...)):
     """Process uploaded PDF, return summary and audio filename."""
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="File must be a PDF")
-    
-    try:
-        pdf_content = await file.read()
-        pdf_text = pdf_processor.extract_text_from_pdf(pdf_content)
-        
+    await pdf_tools_component.get()
+    pdf_content = await file.read()
+
+    async def summarize():
+        pdf_text = await asyncio.to_thread(pdf_processor.extract_text_from_pdf, pdf_content)
         if not pdf_text.strip():
             raise HTTPException(status_code=400, detail="No text found in PDF")
-        
-        # This implementation summarizes the entire document text for better results.
-        # The chunking/retrieval is kept for potential future RAG-based summarization.
-        summary = pdf_processor.summarize_text(pdf_text)
-        audio_filename = pdf_processor.text_to_speech(summary)
-        
+
+        # Long documents are summarized in parallel pieces and merged (see summarizer.py)
+        summary = await pdf_processor.summarize_text(pdf_text)
+        tts_start = time.perf_counter()
+        audio_filename = await asyncio.to_thread(pdf_processor.text_to_speech, summary.text)
+        timings = {**summary.timings, "tts": time.perf_counter() - tts_start}
+
         return {
-            "summary": summary,
+            "summary": summary.text,
             "audio_filename": audio_filename,
-            "status": "success"
+            "status": "success",
+            "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+            "chunks": summary.chunks,
+            "summary_calls": summary.calls,
+            "failed_calls": summary.failed,
         }
+
+    try:
+        # Simultaneous uploads of the same file share one extraction, summary and gTTS call
+        content_hash = hashlib.sha256(pdf_content).hexdigest()
+        return await upload_flights.do(content_hash, summarize)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Unexpected error processing PDF: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-# Endpoint for RAG-based clause evaluation (from App 2)
-@app.post("/evaluate", response_model=EvaluationResponse)
-def evaluate(request: ClauseRequest):
-    """Evaluates a prompt to generate and assess a legal clause."""
-    if not request.prompt or not request.prompt.strip():
-        raise HTTPException(status_code=400, detail="Prompt cannot be empty.")
-    if len(request.prompt.split()) < 3:
-        raise HTTPException(status_code=400, detail="Prompt is too short to be meaningful.")
-
-    retrieved_chunks = rag_pipeline.retrieve(request.prompt)
-    if not retrieved_chunks:
-        raise HTTPException(status_code=404, detail="No relevant information found.")
+def review_page(doc, page_number: int, min_level: int) -> tuple[int, list]:
+    """
+    Extracts one PDF page, segments it into clauses and scores them all in one batch.
+    Returns the number of clauses and a record per clause at or above `min_level`, with
+    its span in the page's text.
+    """
+    text = doc[page_number].get_text("text")
+    clauses = list(chunker.iter_clauses(text))
+    records = []
+    for clause, analysis in zip(clauses, risk_assessor.analyze_many([clause.text for clause in clauses])):
+        if risk_assessor.get_risk_level_value(analysis["risk"]) >= min_level:
+            records.append({
+                "page": page_number + 1,
+                "span": [clause.start, clause.end],
+                "category": analysis["classification"],
+                "risk": analysis["risk"],
+                "text": clause.text,
+            })
+    return len(clauses), records
+
+# Endpoint for a clause-by-clause risk review of an uploaded contract
+@app.post("/review-pdf/")
+async def review_pdf(file: UploadFile = File(...), min_risk: str = DEFAULT_RISK):
+    """
+    Segments an uploaded contract into clauses and scores each one's risk and category,
+    streaming NDJSON as each page is done so the first pages of a long agreement arrive
+    right away. One line per clause at or above `min_risk`: page (1-based), span (character
+    offsets in that page's text), category, risk and text. Clauses are cut at page breaks.
+    A last line counts the pages and clauses reviewed and the streamed clauses per risk
+    level; an `error` line reports a failure after the stream has started.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+    if min_risk not in RISK_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Unknown risk level '{min_risk}'. Choose from {', '.join(RISK_LEVELS)}.")
+    await pdf_tools_component.get()
+    pdf_content = await file.read()
+    doc = await asyncio.to_thread(pdf_processor.open_pdf, pdf_content)
+    min_level, page_count = RISK_LEVELS[min_risk], doc.page_count
+
+    async def lines():
+        clauses, risks = 0, Counter()
+        try:
+            for page_number in range(page_count):
+                page_clauses, records = await asyncio.to_thread(review_page, doc, page_number, min_level)
+                clauses += page_clauses
+                risks.update(record["risk"] for record in records)
+                if records:
+                    yield "".join(json.dumps(record) + "\n" for record in records)
+        except Exception as e:
+            logger.error(f"Error reviewing PDF: {e}")
+            yield json.dumps({"error": "Error processing PDF file"}) + "\n"
+            return
+        finally:
+            doc.close()
+        yield json.dumps({"summary": {"pages": page_count, "clauses": clauses, "risk": dict(risks)}}) + "\n"
+
+    # No proxy buffering, so each page's lines reach the client as soon as they are sent
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=headers)
+
+def document_info(index, cached: bool = False, index_cached: bool = True) -> DocumentInfo:
+    return DocumentInfo(
+        document_id=index.document_id, pages=index.pages, chunks=len(index.chunks), cached=cached, index_cached=index_cached,
+    )
+
+async def index_pages(rag_pipeline, document_id: str, pages: list):
+    """Builds a document's index and caches it; returns the index and whether it fit in the cache."""
+    index = await build_document_index(document_id, pages, rag_pipeline.embeddings_model)
+    if index is None:
+        raise HTTPException(status_code=400, detail="No text found in PDF")
+    return index, document_indexes.put(index)
 
-    generated_clause = rag_pipeline.generate(request.prompt, retrieved_chunks)
-    risk = risk_assessor.assess_risk(generated_clause)
-    classification = risk_assessor.classify_clause(generated_clause)
+# Endpoint for indexing an uploaded document for questions
+@app.post("/documents/", response_model=DocumentInfo)
+async def upload_document(file: UploadFile = File(...), rag_pipeline=Depends(get_rag_pipeline)):
+    """
+    Indexes an uploaded PDF for /documents/{document_id}/ask. The document is identified by
+    the SHA-256 of its content, so uploading the same file again reuses its index while it
+    is cached, and otherwise takes its chunk vectors from the embedding cache. The page text
+    is saved, so any worker can rebuild the index for a question.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+    await pdf_tools_component.get()
+    pdf_content = await file.read()
+    document_id = hashlib.sha256(pdf_content).hexdigest()
+    index = document_indexes.get(document_id)
+    if index is not None:
+        return document_info(index, cached=True)
+
+    async def build():
+        pages = await asyncio.to_thread(pdf_processor.extract_pages, pdf_content)
+        indexed = await index_pages(rag_pipeline, document_id, pages)
+        await asyncio.to_thread(save_pages, document_id, pages)
+        return indexed
+
+    # Simultaneous uploads of the same file share one extraction and embedding request
+    index, index_cached = await document_flights.do(document_id, build)
+    return document_info(index, index_cached=index_cached)
+
+async def get_document_index(rag_pipeline, document_id: str):
+    """
+    The index of an uploaded document. One this worker does not hold (uploaded to another
+    worker, evicted, or too large to cache) is rebuilt from the saved page text, with its
+    vectors from the embedding cache.
+    """
+    index = document_indexes.get(document_id)
+    if index is not None:
+        return index
+
+    async def rebuild():
+        pages = await asyncio.to_thread(load_pages, document_id)
+        if pages is None:
+            raise HTTPException(status_code=404, detail="Document not found. Upload it to /documents/ first.")
+        return await index_pages(rag_pipeline, document_id, pages)
+
+    index, _ = await document_flights.do(document_id, rebuild)
+    return index
+
+# Endpoint for questions about an uploaded document
+@app.post("/documents/{document_id}/ask", response_model=DocumentAnswer)
+async def ask_document(document_id: str, request: DocumentQuestion, rag_pipeline=Depends(get_rag_pipeline)):
+    """
+    Answers a question about a document indexed by /documents/ from its `k` most similar
+    passages. Only the question is embedded; the document's vectors come from the cache.
+    """
+    error = validate_prompt(request.question)
+    if error:
+        raise HTTPException(status_code=400, detail=error.replace("Prompt", "Question"))
+    if not 1 <= request.k <= MAX_DOCUMENT_PASSAGES:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {MAX_DOCUMENT_PASSAGES}.")
+    index = await get_document_index(rag_pipeline, document_id)
+
+    vector = (await rag_pipeline.aembed_queries([request.question]))[0]
+    passages = index.search(vector, request.k)
+    answer = await rag_pipeline.aanswer_document(request.question, passages)
+    return DocumentAnswer(answer=answer, passages=[DocumentPassage(**passage._asdict()) for passage in passages])
+
+def validate_prompt(prompt: str) -> Optional[str]:
+    """Returns why a prompt cannot be evaluated, or None if it is fine."""
+    if not prompt or not prompt.strip():
+        return "Prompt cannot be empty."
+    if len(prompt.split()) < 3:
+        return "Prompt is too short to be meaningful."
+    return None
+
+def retrieval_filter(filter: Optional[RetrievalFilter]) -> Optional[dict]:
+    """Converts a request filter for RAGPipeline.retrieve, rejecting unknown agreement types."""
+    if filter is None:
+        return None
+    filter = filter.model_dump(exclude_none=True)
+    types = filter.get("agreement_type") or []
+    known = contract_metadata.AGREEMENT_TYPES + (contract_metadata.OTHER_TYPE,)
+    for agreement_type in [types] if isinstance(types, str) else types:
+        if contract_metadata.normalize_agreement_type(agreement_type) not in known:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown agreement type '{agreement_type}'. See /agreement-types for the valid ones.",
+            )
+    return filter or None
+
+def assess(rag_pipeline, generated_clause: str, retrieved_chunks: list, semantic_classification: Optional[str] = None) -> EvaluationResponse:
+    """Scores a generated clause's risk and category and attaches its source."""
+    analysis = risk_assessor.analyze(generated_clause)
     _, source = rag_pipeline.get_metadata_and_source(retrieved_chunks)
 
     return EvaluationResponse(
         clause=generated_clause,
-        risk=risk,
-        classification=classification,
+        risk=analysis["risk"],
+        classification=analysis["classification"],
         source=source,
-        feedback_options=["Accept", "Re-generate", "Edit"]
+        feedback_options=["Accept", "Re-generate", "Edit"],
+        semantic_classification=semantic_classification,
     )
 
+def cached_evaluation(rag_pipeline, prompt: str, retrieved_chunks: list) -> Optional[EvaluationResponse]:
+    """The answer given to this prompt or an earlier paraphrase of it, if the response cache has one."""
+    cached = rag_pipeline.cached_response(prompt, retrieved_chunks)
+    return cached.model_copy(update={"cached": True}) if cached is not None else None
+
+async def generate_and_assess(rag_pipeline, prompt: str, retrieved_chunks: list, bypass_cache: bool = False) -> EvaluationResponse:
+    """
+    Generates a clause from retrieved chunks and scores its risk and category. Paraphrases
+    of earlier prompts are answered from the semantic response cache unless `bypass_cache`;
+    fresh answers are always stored in it.
+    """
+    if not bypass_cache:
+        cached = cached_evaluation(rag_pipeline, prompt, retrieved_chunks)
+        if cached is not None:
+            return cached
+    semantic_classification = await rag_pipeline.aclassify(prompt, retrieved_chunks)
+    generated_clause = await rag_pipeline.agenerate(prompt, retrieved_chunks)
+    response = assess(rag_pipeline, generated_clause, retrieved_chunks, semantic_classification)
+    rag_pipeline.cache_response(prompt, retrieved_chunks, response)
+    return response
+
+# Requests that find the LLM queue full are turned away instead of waiting indefinitely
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many clauses are being generated right now. Please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Requests for a component that is still loading (or failed to) get a 503 instead of hanging
+@app.exception_handler(NotReadyError)
+async def not_ready_handler(request, exc: NotReadyError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Service not ready: {exc}"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Liveness: the process is up and serving, whether or not its components have loaded
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+# Readiness: every component has loaded, so the instance can take traffic
+@app.get("/ready")
+async def ready():
+    components = {component.name: component.status() for component in COMPONENTS}
+    is_ready = all(component.state == "ready" for component in COMPONENTS)
+    return JSONResponse(status_code=200 if is_ready else 503, content={"ready": is_ready, "components": components})
+
+# Endpoint for RAG-based clause evaluation (from App 2)
+@app.post("/evaluate", response_model=EvaluationResponse)
+async def evaluate(request: ClauseRequest, rag_pipeline=Depends(get_rag_pipeline)):
+    """
+    Evaluates a prompt to generate and assess a legal clause. Runs on the event loop end to
+    end, so waiting on Gemini does not tie up a threadpool thread.
+    """
+    error = validate_prompt(request.prompt)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    filter = retrieval_filter(request.filter)
+
+    async def compute():
+        retrieved_chunks = await rag_pipeline.aretrieve(request.prompt, filter=filter)
+        if not retrieved_chunks:
+            raise HTTPException(status_code=404, detail="No relevant information found.")
+        return await generate_and_assess(rag_pipeline, request.prompt, retrieved_chunks, request.bypass_cache)
+
+    # Concurrent duplicates (same prompt up to case and whitespace, same filter) share one
+    # embedding, search and LLM call
+    key = (normalize_query(request.prompt), contract_metadata.filter_key(filter), request.bypass_cache)
+    return await evaluate_flights.do(key, compute)
+
+def sse_event(event: str, data) -> str:
+    """Formats one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def source_summary(doc) -> dict:
+    """The parts of a retrieved chunk's metadata shown to users as a source."""
+    keys = ("source", "title", "agreement_type", "filer", "date")
+    return {key: doc.metadata.get(key) for key in keys if doc.metadata.get(key) is not None}
+
+# Streaming variant of /evaluate for the drafting UI
+@app.post("/evaluate/stream")
+async def evaluate_stream(request: ClauseRequest, rag_pipeline=Depends(get_rag_pipeline)):
+    """
+    Evaluates a prompt like /evaluate, but answers with server-sent events as results become
+    available: a `sources` event with the retrieved chunks' sources, a `token` event for each
+    piece of the clause as Gemini produces it, then a `result` event with the full
+    EvaluationResponse (risk, classification, ...). A semantic cache hit arrives as a single
+    `token` event. Failures after the stream has started are reported as an `error` event.
+    """
+    error = validate_prompt(request.prompt)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    retrieved_chunks = await rag_pipeline.aretrieve(request.prompt, filter=retrieval_filter(request.filter))
+    if not retrieved_chunks:
+        raise HTTPException(status_code=404, detail="No relevant information found.")
+    cached = None if request.bypass_cache else cached_evaluation(rag_pipeline, request.prompt, retrieved_chunks)
+    # Reject up front while a proper 503 can still be sent; the stream re-checks when it starts
+    if cached is None and rag_pipeline.llm_limiter.is_full():
+        raise QueueFullError(rag_pipeline.llm_limiter.retry_after)
+
+    async def events():
+        yield sse_event("sources", [source_summary(doc) for doc in retrieved_chunks])
+        if cached is not None:
+            yield sse_event("token", {"text": cached.clause})
+            yield sse_event("result", cached.model_dump())
+            return
+        pieces = []
+        try:
+            async for piece in rag_pipeline.astream_generate(request.prompt, retrieved_chunks):
+                pieces.append(piece)
+                yield sse_event("token", {"text": piece})
+        except QueueFullError as e:
+            yield sse_event("error", {"detail": "Server is busy. Please retry shortly.", "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            logger.error(f"Error streaming clause: {e}")
+            yield sse_event("error", {"detail": "Error generating clause."})
+            return
+        semantic_classification = await rag_pipeline.aclassify(request.prompt, retrieved_chunks)
+        response = assess(rag_pipeline, "".join(pieces), retrieved_chunks, semantic_classification)
+        rag_pipeline.cache_response(request.prompt, retrieved_chunks, response)
+        yield sse_event("result", response.model_dump())
+
+    # No-cache and no proxy buffering, so each event reaches the browser as soon as it is sent
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+# Endpoint for evaluating many prompts in one call
+@app.post("/evaluate/batch", response_model=BatchEvaluationResponse)
+async def evaluate_batch(request: BatchClauseRequest, rag_pipeline=Depends(get_rag_pipeline)):
+    """
+    Evaluates a list of prompts. Duplicates are evaluated once, retrieval for all prompts is
+    done with one embedding request and one FAISS search, and clause generation runs
+    concurrently with at most BATCH_GENERATE_CONCURRENCY LLM calls in flight.
+    Results are returned in input order; invalid prompts get an error instead of a result.
+    """
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="Prompts cannot be empty.")
+    if len(request.prompts) > MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_PROMPTS} prompts per batch.")
+
+    filter = retrieval_filter(request.filter)
+    errors = {prompt: validate_prompt(prompt) for prompt in request.prompts}
+    # Prompts that only differ in case or whitespace are evaluated once
+    unique = {}
+    for prompt in request.prompts:
+        if not errors[prompt]:
+            unique.setdefault(normalize_query(prompt), prompt)
+    unique_prompts = list(unique.values())
+
+    retrieved = await rag_pipeline.aretrieve_many(unique_prompts, filter=filter) if unique_prompts else []
+    semaphore = asyncio.Semaphore(BATCH_GENERATE_CONCURRENCY)
+
+    async def evaluate_one(prompt, retrieved_chunks):
+        if not retrieved_chunks:
+            return BatchEvaluationItem(prompt=prompt, error="No relevant information found.")
+        async with semaphore:
+            try:
+                result = await generate_and_assess(rag_pipeline, prompt, retrieved_chunks, request.bypass_cache)
+            except QueueFullError:
+                return BatchEvaluationItem(prompt=prompt, error="Server is busy. Please retry shortly.")
+            except Exception as e:
+                logger.error(f"Error evaluating batch prompt: {e}")
+                return BatchEvaluationItem(prompt=prompt, error="Error generating clause.")
+        return BatchEvaluationItem(prompt=prompt, result=result)
+
+    items = await asyncio.gather(*(evaluate_one(p, chunks) for p, chunks in zip(unique_prompts, retrieved)))
+    by_key = dict(zip(unique.keys(), items))
+
+    results = []
+    for prompt in request.prompts:
+        if errors[prompt]:
+            results.append(BatchEvaluationItem(prompt=prompt, error=errors[prompt]))
+        else:
+            item = by_key[normalize_query(prompt)]
+            results.append(BatchEvaluationItem(prompt=prompt, result=item.result, error=item.error))
+    return BatchEvaluationResponse(results=results)
+
+# Endpoint listing the values accepted by the agreement_type filter
+@app.get("/agreement-types")
+async def agreement_types(rag_pipeline=Depends(get_rag_pipeline)):
+    """Returns each agreement type in the index with its number of contracts and chunks."""
+    index = rag_pipeline.index
+    counts = {}
+    for metadata in index.file_metadata:
+        counts[metadata["agreement_type"]] = counts.get(metadata["agreement_type"], 0) + 1
+    return {
+        agreement_type: {"contracts": n, "chunks": index.count_rows({"agreement_type": agreement_type})}
+        for agreement_type, n in sorted(counts.items())
+    }
+
+# Endpoint exposing RAG cache hit/miss counters
+@app.get("/cache-stats")
+async def cache_stats(rag_pipeline=Depends(get_rag_pipeline)):
+    """Returns hit/miss counters for the query embedding and retrieval caches."""
+    stats = rag_pipeline.cache_stats()
+    stats["coalescing"] = {
+        "evaluate": evaluate_flights.stats(), "upload_pdf": upload_flights.stats(), "documents": document_flights.stats(),
+    }
+    stats["documents"] = document_indexes.stats()
+    return stats
+
+# Risk profile of every clause in the corpus, built offline by build_risk_profile.py
+_risk_profile = None
+
+def get_risk_profile():
+    """Dependency returning the saved risk profile, reloaded whenever build_risk_profile.py rewrites it."""
+    global _risk_profile
+    if not risk_profile.RiskProfile.exists():
+        raise HTTPException(status_code=503, detail="The risk profile has not been built. Run build_risk_profile.py first.")
+    if _risk_profile is None or _risk_profile.version != risk_profile.RiskProfile.current_version():
+        _risk_profile = risk_profile.RiskProfile.load()
+    return _risk_profile
+
+def profile_query(query, *args):
+    """Runs a risk profile query, turning unknown risk levels or categories into a 400."""
+    try:
+        return query(*args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Endpoint querying the risk profile clause by clause
+@app.get("/risk-profile/clauses")
+def risk_profile_clauses(
+    risk: Optional[list[str]] = Query(None),
+    category: Optional[list[str]] = Query(None),
+    agreement_type: Optional[list[str]] = Query(None),
+    filer: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=risk_profile.MAX_QUERY_LIMIT),
+    offset: int = Query(0, ge=0),
+    profile=Depends(get_risk_profile),
+):
+    """
+    Clauses of every profiled contract with the given risk levels and categories, e.g. all
+    High-risk Liability clauses in reseller agreements:
+    ?risk=High&category=Liability&agreement_type=reseller. Each clause is given by its
+    contract, character offset and length. Parameters can be repeated to match any of
+    several values.
+    """
+    filter = retrieval_filter(RetrievalFilter(agreement_type=agreement_type, filer=filer, date_from=date_from, date_to=date_to))
+    total, clauses = profile_query(profile.query, risk, category, filter, limit, offset)
+    return {"total": total, "offset": offset, "clauses": clauses}
+
+# Endpoint summarizing the risk profile per contract
+@app.get("/risk-profile/contracts")
+def risk_profile_contracts(
+    risk: Optional[list[str]] = Query(None),
+    category: Optional[list[str]] = Query(None),
+    agreement_type: Optional[list[str]] = Query(None),
+    filer: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=risk_profile.MAX_QUERY_LIMIT),
+    offset: int = Query(0, ge=0),
+    profile=Depends(get_risk_profile),
+):
+    """
+    Clause counts by risk level and category for each contract, most high-risk clauses
+    first. With `risk` or `category`, only matching clauses are counted and contracts
+    without any are left out.
+    """
+    filter = retrieval_filter(RetrievalFilter(agreement_type=agreement_type, filer=filer, date_from=date_from, date_to=date_to))
+    total, contracts = profile_query(profile.contract_summaries, risk, category, filter, limit, offset)
+    return {"total": total, "offset": offset, "contracts": contracts}
+
+# Endpoint for classifying many clauses by embedding
+@app.post("/classify", response_model=list[ClauseClassification])
+async def classify(request: ClassifyRequest, rag_pipeline=Depends(get_rag_pipeline)):
+    """
+    Classifies clauses by their nearest category centroid. All clauses are embedded with a
+    single request (already embedded ones come from the embedding cache) and scored with one
+    matrix product. Results are returned in input order.
+    """
+    if not request.clauses or any(not clause.strip() for clause in request.clauses):
+        raise HTTPException(status_code=400, detail="Clauses cannot be empty.")
+    if len(request.clauses) > MAX_CLASSIFY_CLAUSES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CLASSIFY_CLAUSES} clauses per request.")
+    if rag_pipeline.classifier is None:
+        raise HTTPException(
+            status_code=503, detail="Clause centroids have not been computed. Run create_index.py or clause_classifier.py."
+        )
+
+    vectors = await rag_pipeline.embeddings_model.aembed_documents(request.clauses)
+    labels, scores = rag_pipeline.classify_vectors(vectors)
+    return [ClauseClassification(classification=label, score=float(score)) for label, score in zip(labels, scores)]
+
 # Endpoint to download a clause as a PDF (from App 2)
 @app.post("/download_pdf")
 async def download_pdf(request: PdfRequest):
@@ -338,6 +891,7 @@ async def download_pdf(request: PdfRequest):
     if not request.clause or not request.clause.strip():
         raise HTTPException(status_code=400, detail="Text content cannot be empty.")
 
+    from test import text_to_pdf
     output_filename = "generated_clause.pdf"
     text_to_pdf(request.clause, output_filename)
 
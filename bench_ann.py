@@ -0,0 +1,128 @@
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+import ann_index
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Script Constants ---
+FAISS_INDEX_PATH = "faiss_index"
+NUM_QUERIES = 200
+TOP_K = 5
+SEED = 42
+
+# Settings compared against the exact flat index. Each entry is (index_type, params).
+BENCHMARK_SETTINGS = [
+    ("flat", {}),
+    ("ivf_flat", {"nprobe": 1}),
+    ("ivf_flat", {"nprobe": 8}),
+    ("ivf_flat", {"nprobe": 32}),
+    ("ivf_pq", {"nprobe": 8}),
+    ("ivf_pq", {"nprobe": 32}),
+    ("hnsw", {"hnsw_m": 16, "ef_search": 32}),
+    ("hnsw", {"hnsw_m": 32, "ef_search": 64}),
+    ("hnsw", {"hnsw_m": 32, "ef_search": 128}),
+]
+
+
+def load_corpus_vectors(index_path):
+    """Reads the vectors of a saved index (as written by create_index.py)."""
+    index = faiss.read_index(str(Path(index_path) / "index.faiss"))
+    return ann_index.reconstruct_all(index)
+
+
+def synthetic_vectors(n, dim, seed=SEED):
+    """Clustered random vectors, roughly shaped like text embeddings, for offline runs."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 50), dim)).astype(np.float32)
+    assignments = rng.integers(0, len(centers), size=n)
+    return centers[assignments] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def split_queries(vectors, num_queries, seed=SEED):
+    """Holds out `num_queries` vectors (plus a little noise) as queries; the rest is the corpus."""
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    queries = vectors[order[:num_queries]]
+    queries = queries + 0.01 * rng.normal(size=queries.shape).astype(np.float32)
+    return np.ascontiguousarray(vectors[order[num_queries:]]), np.ascontiguousarray(queries)
+
+
+def recall_at_k(found, truth):
+    """Fraction of the true top-k neighbours that the index returned."""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def benchmark_setting(corpus, queries, truth, index_type, params, k):
+    """Builds one index setting and measures build time, memory, recall and per-query latency."""
+    start = time.perf_counter()
+    index = ann_index.build_index(corpus, index_type, **params)
+    build_seconds = time.perf_counter() - start
+
+    # Single-query latency, as seen by one /evaluate request
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        found[i] = ids[0]
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "setting": f"{index_type} {params}" if params else index_type,
+        "recall": recall_at_k(found, truth),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "memory_mb": ann_index.index_memory_bytes(index) / (1024 * 1024),
+        "build_s": build_seconds,
+    }
+
+
+def run_benchmark(vectors, num_queries=NUM_QUERIES, k=TOP_K, settings=BENCHMARK_SETTINGS):
+    """Runs every setting against exact flat-index ground truth and returns the result rows."""
+    corpus, queries = split_queries(vectors, num_queries)
+    logging.info(f"Benchmarking on {len(corpus)} vectors of dimension {corpus.shape[1]} with {len(queries)} queries (k={k}).")
+
+    flat = ann_index.build_index(corpus, "flat")
+    _, truth = flat.search(queries, k)
+
+    results = []
+    for index_type, params in settings:
+        logging.info(f"Building '{index_type}' with {params or 'default parameters'}...")
+        results.append(benchmark_setting(corpus, queries, truth, index_type, params, k))
+    return results
+
+
+def print_results(results, k=TOP_K):
+    header = f"{'setting':<48} {'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} {'mem MB':>8} {'build s':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['setting']:<48} {r['recall']:>9.3f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} "
+            f"{r['memory_mb']:>8.2f} {r['build_s']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare FAISS index types on recall@k, latency and memory.")
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH, help="Saved index whose vectors are used as the corpus.")
+    parser.add_argument("--synthetic", type=int, help="Use N synthetic vectors instead of a saved index.")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors.")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES, help="Number of held-out query vectors.")
+    parser.add_argument("-k", type=int, default=TOP_K, help="Neighbours retrieved per query.")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    else:
+        vectors = load_corpus_vectors(args.index_path)
+    print_results(run_benchmark(vectors, args.queries, args.k), args.k)
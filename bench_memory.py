@@ -0,0 +1,100 @@
+import os
+import logging
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+from compact_store import CompactVectorStore
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Script Constants ---
+FAISS_INDEX_PATH = "faiss_index"
+WORKER_COUNTS = (1, 2, 4)
+NUM_QUERIES = 200
+TOP_K = 5
+SEED = 42
+
+
+def memory_mb(pid):
+    """
+    RSS, PSS and private memory of a process in MB (Linux only). RSS counts every shared page
+    in full in every process; PSS splits shared pages between the processes that map them,
+    so the PSS of all workers adds up to what they actually cost the machine.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def worker(index_path, mmap, num_queries, k, ready, done):
+    """Loads the store like one API worker, serves queries until its pages are resident, then waits."""
+    store = CompactVectorStore.load(index_path, embedding=None, mmap=mmap)
+    rng = np.random.default_rng(SEED + os.getpid())
+    for rows in store.search_rows(rng.normal(size=(num_queries, store.index.d)), k):
+        for row in rows:
+            store.chunk_text(row)
+    ready.put(os.getpid())
+    done.wait()
+
+
+def measure(index_path, workers, mmap, num_queries=NUM_QUERIES, k=TOP_K):
+    """Starts `workers` processes the way `uvicorn --workers` does (spawned, not forked) and sums their memory."""
+    ctx = mp.get_context("spawn")
+    ready, done = ctx.Queue(), ctx.Event()
+    processes = [ctx.Process(target=worker, args=(index_path, mmap, num_queries, k, ready, done)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        pids = [ready.get(timeout=600) for _ in processes]
+        usage = [memory_mb(pid) for pid in pids]
+    finally:
+        done.set()
+        for process in processes:
+            process.join()
+    return {
+        "setting": f"{'mmap' if mmap else 'in-memory'} x{workers}",
+        "rss_per_worker": sum(u["rss"] for u in usage) / workers,
+        "rss_total": sum(u["rss"] for u in usage),
+        "pss_total": sum(u["pss"] for u in usage),
+        "private_per_worker": sum(u["private"] for u in usage) / workers,
+    }
+
+
+def print_results(results):
+    header = f"{'setting':<16} {'RSS/worker MB':>14} {'RSS sum MB':>11} {'PSS sum MB':>11} {'private/worker MB':>18}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['setting']:<16} {r['rss_per_worker']:>14.1f} {r['rss_total']:>11.1f} "
+            f"{r['pss_total']:>11.1f} {r['private_per_worker']:>18.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how worker memory scales with memory-mapped vs in-memory index loading.")
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH, help="Saved index to load in every worker.")
+    parser.add_argument("--workers", type=int, nargs="+", default=WORKER_COUNTS, help="Worker counts to measure.")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES, help="Queries each worker runs before it is measured.")
+    parser.add_argument("-k", type=int, default=TOP_K, help="Neighbours retrieved per query.")
+    args = parser.parse_args()
+
+    if not CompactVectorStore.exists(args.index_path):
+        raise SystemExit(f"No index at '{args.index_path}'. Run create_index.py first.")
+    results = []
+    for mmap in (True, False):
+        for workers in args.workers:
+            logging.info(f"Measuring {workers} worker(s), {'memory-mapped' if mmap else 'in-memory'} index...")
+            results.append(measure(args.index_path, workers, mmap, args.queries, args.k))
+    print_results(results)
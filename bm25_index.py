@@ -0,0 +1,146 @@
+import re
+import json
+import math
+from array import array
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+# --- On-Disk Layout (next to the compact store, sharing its chunk row numbers) ---
+# bm25.json          vocabulary (term -> term id) plus k1, b and the average chunk length
+# bm25_offsets.npy   postings of term t are rows offsets[t]:offsets[t + 1] of bm25_postings.npy
+# bm25_postings.npy  (chunk row, term frequency) pairs, sorted by chunk row within each term
+# bm25_doclens.npy   token count of every chunk
+VOCAB_FILENAME = "bm25.json"
+OFFSETS_FILENAME = "bm25_offsets.npy"
+POSTINGS_FILENAME = "bm25_postings.npy"
+DOCLENS_FILENAME = "bm25_doclens.npy"
+FILENAMES = (VOCAB_FILENAME, OFFSETS_FILENAME, POSTINGS_FILENAME, DOCLENS_FILENAME)
+
+POSTING_DTYPE = np.dtype([("row", "<u4"), ("tf", "<u2")])
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "shall any such all other which under upon each may not no".split()
+)
+
+
+def tokenize(text):
+    """Lowercased alphanumeric tokens without common English and contract boilerplate words."""
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over the chunks of a compact store."""
+
+    def __init__(self, vocab, offsets, postings, doc_lens, k1=K1, b=B, avg_doc_len=None):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.postings = postings
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_len = avg_doc_len if avg_doc_len is not None else float(np.mean(doc_lens) if len(doc_lens) else 0.0)
+        # Per-chunk length normalisation term of the BM25 denominator, computed once
+        self._norm = (k1 * (1 - b + b * doc_lens / max(self.avg_doc_len, 1e-9))).astype(np.float32)
+
+    @property
+    def num_docs(self):
+        return len(self.doc_lens)
+
+    @classmethod
+    def build(cls, texts, k1=K1, b=B):
+        """Builds the index from chunk texts given in chunk row order."""
+        term_rows, term_tfs, vocab, doc_lens = [], [], {}, array("I")
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = vocab.setdefault(term, len(vocab))
+                if term_id == len(term_rows):
+                    term_rows.append(array("I"))
+                    term_tfs.append(array("H"))
+                term_rows[term_id].append(row)
+                term_tfs[term_id].append(min(tf, 0xFFFF))
+
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in term_rows])
+        postings = np.empty(int(offsets[-1]), dtype=POSTING_DTYPE)
+        for term_id, (rows, tfs) in enumerate(zip(term_rows, term_tfs)):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            postings["row"][start:end] = rows
+            postings["tf"][start:end] = tfs
+        return cls(vocab, offsets, postings, np.frombuffer(doc_lens, dtype=np.uint32).copy(), k1, b)
+
+    @classmethod
+    def exists(cls, path):
+        return all((Path(path) / name).exists() for name in FILENAMES)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        with open(path / VOCAB_FILENAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        return cls(
+            meta["vocab"],
+            np.load(path / OFFSETS_FILENAME, mmap_mode=mode),
+            np.load(path / POSTINGS_FILENAME, mmap_mode=mode),
+            np.load(path / DOCLENS_FILENAME),
+            meta["k1"], meta["b"], meta["avg_doc_len"],
+        )
+
+    def save(self, path, suffix=""):
+        """Writes the index files into `path`, each name followed by `suffix` (e.g. ".tmp")."""
+        path = Path(path)
+        for name, array_ in ((OFFSETS_FILENAME, self.offsets), (POSTINGS_FILENAME, self.postings), (DOCLENS_FILENAME, self.doc_lens)):
+            with open(path / (name + suffix), "wb") as f:
+                np.save(f, array_)
+        with open(path / (VOCAB_FILENAME + suffix), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "avg_doc_len": self.avg_doc_len, "vocab": self.vocab}, f)
+
+    def scores(self, query):
+        """
+        Scores every chunk against the query. Returns the BM25 scores and, per chunk, the
+        fraction of the query's distinct indexed terms it contains.
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        matched = np.zeros(self.num_docs, dtype=np.uint16)
+        term_ids = [self.vocab[term] for term in set(tokenize(query)) if term in self.vocab]
+        for term_id in term_ids:
+            postings = self.postings[self.offsets[term_id]:self.offsets[term_id + 1]]
+            df = len(postings)
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            tf = postings["tf"].astype(np.float32)
+            rows = postings["row"]
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self._norm[rows])
+            matched[rows] += 1
+        return scores, matched / max(len(term_ids), 1)
+
+    def search(self, query, k=5, mask=None):
+        """
+        Returns up to k (chunk row, score, term coverage) triples with a positive score, best
+        first. A boolean `mask` over the chunk rows restricts the search to the rows it selects.
+        """
+        scores, coverage = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row), float(scores[row]), float(coverage[row])) for row in top if scores[row] > 0]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several ranked lists of chunk rows; returns rows ordered by summed 1 / (k + rank)."""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+import chunker
+import contract_metadata
+import risk_profile
+from file_hashing import file_sha256
+from risk_assessor import DEFAULT_CLASSIFICATION, RiskAssessor
+from risk_profile import CATEGORIES, RISKS, RiskProfile
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Script Constants ---
+SOURCE_DOCUMENTS_PATH = "full_contract_txt"
+RISK_PROFILE_PATH = risk_profile.RISK_PROFILE_PATH
+CLAUSE_SIZE = chunker.CLAUSE_SIZE
+FILES_PER_TASK = 4  # Files handed to a worker process at a time
+
+_assessor = RiskAssessor()
+
+
+def profile_file(path, clause_size=CLAUSE_SIZE):
+    """Segments one contract into clauses and scores them; returns its result columns. Runs in a worker process."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    clauses = list(chunker.iter_clauses(text, clause_size))
+    analyses = _assessor.analyze_many([clause.text for clause in clauses])
+    return {
+        "offset": np.array([clause.start for clause in clauses], dtype=np.uint32),
+        "length": np.array([clause.end - clause.start for clause in clauses], dtype=np.uint32),
+        "category": np.array([CATEGORIES.index(a["classification"]) for a in analyses], dtype=np.uint8),
+        "categories": np.array(
+            [risk_profile.category_mask(a["categories"] or [DEFAULT_CLASSIFICATION]) for a in analyses], dtype=np.uint8
+        ),
+        "risk": np.array([RISKS.index(a["risk"]) for a in analyses], dtype=np.uint8),
+    }
+
+
+def carry_over(profile, keep_names):
+    """Result columns and file entries of the unchanged files of an existing profile, renumbered."""
+    keep = [file_id for file_id, f in enumerate(profile.files) if f["name"] in keep_names]
+    new_ids = np.full(len(profile.files), -1, dtype=np.int64)
+    new_ids[keep] = np.arange(len(keep))
+    rows = np.flatnonzero(new_ids[profile.columns["file_id"]] >= 0)
+    columns = {name: np.asarray(column[rows]) for name, column in profile.columns.items()}
+    columns["file_id"] = new_ids[columns["file_id"]].astype(np.uint32)
+    return [profile.files[file_id] for file_id in keep], columns
+
+
+def build_profile(source_path=SOURCE_DOCUMENTS_PATH, profile_path=RISK_PROFILE_PATH, workers=None, full_rebuild=False):
+    """
+    Profiles every contract in `source_path` into the columnar store at `profile_path`.
+    Only new and changed files are scored (in a process pool using every core); the
+    results of unchanged files are carried over.
+    """
+    files = sorted(Path(source_path).glob("*.txt"))
+    if not files:
+        logging.error(f"No .txt files found in '{source_path}'. Aborting.")
+        return
+    file_hashes = {file.name: file_sha256(file) for file in files}
+    settings = {"clause_size": CLAUSE_SIZE, "keywords": risk_profile.keyword_signature()}
+
+    profile = None
+    if not full_rebuild and RiskProfile.exists(profile_path):
+        profile = RiskProfile.load(profile_path, mmap=False)
+        if profile.settings != settings or profile.categories != CATEGORIES or profile.risks != RISKS:
+            logging.info("Clause size or keywords changed since the last run; profiling every contract again.")
+            profile = None
+
+    if profile is not None:
+        profiled = {f["name"]: f["sha256"] for f in profile.files}
+        unchanged = {name for name, sha256 in file_hashes.items() if profiled.get(name) == sha256}
+        deleted = set(profiled) - set(file_hashes)
+        to_profile = [file for file in files if file.name not in unchanged]
+        logging.info(f"Incremental update: {len(to_profile)} new or changed, {len(deleted)} deleted contracts.")
+        if not to_profile and not deleted:
+            logging.info("✅ Risk profile is already up to date. Nothing to do.")
+            return
+        kept_files, kept_columns = carry_over(profile, unchanged)
+    else:
+        to_profile = files
+        kept_files, kept_columns = [], risk_profile.empty_columns()
+
+    workers = workers or os.cpu_count()
+    logging.info(f"Profiling {len(to_profile)} contracts with {workers} worker processes...")
+    start_time = time.time()
+    new_files, new_columns = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(profile_file, to_profile, chunksize=FILES_PER_TASK)
+        for file, columns in tqdm(zip(to_profile, results), total=len(to_profile), desc="Profiling contracts"):
+            file_id = len(kept_files) + len(new_files)
+            columns["file_id"] = np.full(len(columns["offset"]), file_id, dtype=np.uint32)
+            new_columns.append(columns)
+            new_files.append({
+                "name": file.name, "source": str(file), "sha256": file_hashes[file.name],
+                "metadata": contract_metadata.parse_filename(file.name), "clauses": len(columns["offset"]),
+            })
+    elapsed = time.time() - start_time
+
+    columns = {name: np.concatenate([kept_columns[name]] + [c[name] for c in new_columns]) for name in risk_profile.COLUMN_DTYPES}
+    risk_profile.save_profile(profile_path, kept_files + new_files, columns, settings)
+    total = sum(len(c["offset"]) for c in new_columns)
+    logging.info(
+        f"✅ Profiled {total} clauses from {len(to_profile)} contracts in {elapsed:.2f}s "
+        f"({total / elapsed if elapsed else 0:.0f} clauses/s); the profile holds {len(columns['offset'])} clauses."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every clause of every contract for risk and category.")
+    parser.add_argument("--source", default=SOURCE_DOCUMENTS_PATH, help="Folder of contract .txt files.")
+    parser.add_argument("--output", default=RISK_PROFILE_PATH, help="Folder the risk profile is written to.")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core).")
+    parser.add_argument("--full", action="store_true", help="Ignore the existing profile and score every contract again.")
+    args = parser.parse_args()
+    build_profile(args.source, args.output, args.workers, args.full)
@@ -0,0 +1,164 @@
+import re
+from collections import namedtuple
+
+# --- Chunker Constants ---
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+CLAUSE_SIZE = 1000  # Longest clause before it is cut on paragraphs, lines or sentences
+
+# A chunk of `text[start:end]`; offsets are character positions in the source text
+Chunk = namedtuple("Chunk", ["text", "start", "end"])
+
+# Headings that open a new unit of a contract: "ARTICLE IV", "Section 2.3", "12.1 Term.",
+# "EXHIBIT B", "SCHEDULE 1", "ANNEX A", "APPENDIX 2"
+HEADING_RE = re.compile(
+    r"(?:ARTICLE|Article|SECTION|Section|EXHIBIT|Exhibit|SCHEDULE|Schedule|ANNEX|Annex|APPENDIX|Appendix)"
+    r"[ \t]+[0-9IVXLCA-Z][0-9IVXLC.]*"
+    r"|\d{1,3}\.(?:\d{1,3}\.)*\d{0,3}[ \t]+(?=[A-Z(\"])"
+)
+# Places a heading can start: after a newline, or after the run of spaces that the CUAD text
+# files leave where a line break used to be. Headings are only tried at these positions.
+LINE_BREAK_RE = re.compile(r"\n[ \t]*|[ \t]{3,}")
+# Paragraph breaks: a blank line, or the run of spaces CUAD leaves where one used to be
+PARAGRAPH_RE = re.compile(r"\n[ \t]*\n|[ \t]{3,}")
+# Fallback separators for a single paragraph that is still too long, coarsest first
+FALLBACK_SEPARATORS = [re.compile(r"\n"), re.compile(r"(?<=[.;:])\s+"), re.compile(r"\s+")]
+
+
+def _strip_span(text, start, end):
+    """Shrinks a span so it does not begin or end with whitespace."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _section_spans(text):
+    """Yields (start, end) of each structural section; the whole text if there are none."""
+    start = 0
+    for match in LINE_BREAK_RE.finditer(text):
+        heading_start = match.end()
+        if heading_start > start and HEADING_RE.match(text, heading_start):
+            yield start, heading_start
+            start = heading_start
+    yield start, len(text)
+
+
+def _split_on(pattern, text, start, end):
+    """Yields the spans between matches of `pattern` inside text[start:end]."""
+    for match in pattern.finditer(text, start, end):
+        if match.start() > start:
+            yield start, match.start()
+        start = match.end()
+    if start < end:
+        yield start, end
+
+
+def _pieces(text, start, end, chunk_size, separators):
+    """
+    Yields spans of at most `chunk_size` characters covering text[start:end], cutting on the
+    coarsest separator that works and only cutting mid-word as a last resort.
+    """
+    if end - start <= chunk_size:
+        yield start, end
+        return
+    if not separators:
+        for cut in range(start, end, chunk_size):
+            yield cut, min(cut + chunk_size, end)
+        return
+    for sub_start, sub_end in _split_on(separators[0], text, start, end):
+        yield from _pieces(text, sub_start, sub_end, chunk_size, separators[1:])
+
+
+def _section_pieces(text, start, end, chunk_size):
+    """
+    Splits one section into pieces. Sections that fit are yielded whole (the fast path);
+    longer ones are cut into paragraphs, then lines, sentences and words.
+    """
+    if end - start <= chunk_size:
+        yield start, end
+        return
+    for para_start, para_end in _split_on(PARAGRAPH_RE, text, start, end):
+        yield from _pieces(text, para_start, para_end, chunk_size, FALLBACK_SEPARATORS)
+
+
+def _overlap_start(text, start, end, chunk_overlap):
+    """Start of the last ~`chunk_overlap` characters of text[start:end], moved to a word boundary."""
+    if chunk_overlap <= 0 or end - start <= chunk_overlap:
+        return end
+    cut = end - chunk_overlap
+    space = text.find(" ", cut, end)
+    return space + 1 if space != -1 else cut
+
+
+def iter_chunks(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Lazily splits a contract into chunks of at most `chunk_size` characters.
+
+    Chunks start at section boundaries (articles, numbered sections, exhibits and
+    schedules) where possible, and consecutive small sections are packed together. Only
+    sections longer than `chunk_size` are cut further, and only those cuts carry up to
+    `chunk_overlap` characters of context from the previous chunk. Text without any
+    recognised structure is split on paragraphs.
+
+    Yields Chunk(text, start, end) with character offsets into `text`; nothing but the
+    current chunk is held in memory.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size}).")
+
+    chunk_start = chunk_end = None
+    for section_start, section_end in _section_spans(text):
+        first_piece = True
+        for piece_start, piece_end in _section_pieces(text, section_start, section_end, chunk_size - chunk_overlap):
+            piece_start, piece_end = _strip_span(text, piece_start, piece_end)
+            if piece_start == piece_end:
+                continue
+            if chunk_start is not None and piece_end - chunk_start <= chunk_size:
+                chunk_end = piece_end  # Pack the piece into the current chunk
+            else:
+                if chunk_start is not None:
+                    yield Chunk(text[chunk_start:chunk_end], chunk_start, chunk_end)
+                    # Inside an oversized section, carry some context over from the last chunk
+                    if first_piece:
+                        chunk_start = piece_start
+                    else:
+                        overlap_start = _overlap_start(text, chunk_start, chunk_end, chunk_overlap)
+                        chunk_start = min(max(overlap_start, piece_end - chunk_size), piece_start)
+                else:
+                    chunk_start = piece_start
+                chunk_end = piece_end
+            first_piece = False
+    if chunk_start is not None:
+        yield Chunk(text[chunk_start:chunk_end], chunk_start, chunk_end)
+
+
+def iter_clauses(text, max_size=CLAUSE_SIZE):
+    """
+    Lazily segments a contract into clauses for per-clause analysis: one per section, with
+    sections longer than `max_size` cut into runs of whole paragraphs (or lines, sentences,
+    words) of up to `max_size` characters. Unlike chunks, clauses never span two sections
+    and never overlap.
+
+    Yields Chunk(text, start, end) with character offsets into `text`.
+    """
+    for section_start, section_end in _section_spans(text):
+        clause_start = clause_end = None
+        for start, end in _section_pieces(text, section_start, section_end, max_size):
+            start, end = _strip_span(text, start, end)
+            if start == end:
+                continue
+            if clause_start is not None and end - clause_start <= max_size:
+                clause_end = end
+                continue
+            if clause_start is not None:
+                yield Chunk(text[clause_start:clause_end], clause_start, clause_end)
+            clause_start, clause_end = start, end
+        if clause_start is not None:
+            yield Chunk(text[clause_start:clause_end], clause_start, clause_end)
+
+
+def split_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Convenience wrapper returning only the chunk strings, as a list."""
+    return [chunk.text for chunk in iter_chunks(text, chunk_size, chunk_overlap)]
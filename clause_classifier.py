@@ -0,0 +1,151 @@
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+import ann_index
+from compact_store import CompactVectorStore
+from risk_assessor import CLASSIFICATION_KEYWORDS, DEFAULT_CLASSIFICATION, RiskAssessor
+from vector_math import unit_rows
+
+logger = logging.getLogger(__name__)
+
+# --- On-Disk Layout ---
+# Stored inside the index folder, since the centroids live in the index's embedding space:
+# centroids.npy   (labels, dim) float32 matrix of unit-length category centroids
+# centroids.json  labels, the number of chunks behind each centroid, and the embedding model
+#                 and index version they were computed from
+CENTROIDS_FILENAME = "centroids.npy"
+CENTROIDS_META_FILENAME = "centroids.json"
+LABELS = tuple(CLASSIFICATION_KEYWORDS) + (DEFAULT_CLASSIFICATION,)
+MIN_EXAMPLES = 5  # Categories with fewer labeled chunks get no centroid
+
+
+def weak_labels(texts, assessor=None):
+    """
+    Labels corpus chunks with the keyword classifier where it is unambiguous: the one
+    category whose keywords a chunk mentions, or General if it mentions none. Chunks
+    mentioning several categories get None and are left out of training.
+    """
+    assessor = assessor or RiskAssessor()
+    labels = []
+    for analysis in assessor.analyze_many(texts):
+        categories = analysis["categories"]
+        labels.append(categories[0] if len(categories) == 1 else None if categories else DEFAULT_CLASSIFICATION)
+    return labels
+
+
+class CentroidClassifier:
+    """
+    Nearest-centroid clause classifier over embeddings. Each category is the normalized mean
+    of the unit-length vectors of its labeled chunks. Classifying a batch of vectors is one
+    matrix product against the centroid matrix. No model is called, so a vector computed for
+    retrieval can be reused as is.
+    """
+
+    def __init__(self, labels, centroids, counts=None, embedding=None, index_version=None):
+        self.labels = tuple(labels)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.counts = dict(counts or {})
+        self.embedding = embedding
+        self.index_version = index_version
+
+    @classmethod
+    def fit(cls, vectors, labels, min_examples=MIN_EXAMPLES, **kwargs):
+        """Computes centroids from vectors and their labels; vectors labeled None are ignored."""
+        vectors = unit_rows(vectors)
+        labels = np.asarray(labels, dtype=object)
+        names, centroids, counts = [], [], {}
+        for label in LABELS:
+            members = labels == label
+            counts[label] = int(members.sum())
+            if counts[label] >= min_examples:
+                names.append(label)
+                centroids.append(vectors[members].mean(axis=0))
+        if not names:
+            raise ValueError(f"No category has {min_examples} labeled chunks; cannot compute centroids.")
+        return cls(names, unit_rows(centroids), counts, **kwargs)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        with open(path / CENTROIDS_META_FILENAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            meta["labels"], np.load(path / CENTROIDS_FILENAME), meta.get("counts"), meta.get("embedding"),
+            meta.get("index_version"),
+        )
+
+    @classmethod
+    def exists(cls, path):
+        return all((Path(path) / name).exists() for name in (CENTROIDS_FILENAME, CENTROIDS_META_FILENAME))
+
+    def save(self, path):
+        """Writes the centroids next to the index they were computed from."""
+        path = Path(path)
+        with open(path / (CENTROIDS_FILENAME + ".tmp"), "wb") as f:
+            np.save(f, self.centroids)
+        meta = {
+            "labels": self.labels, "counts": self.counts, "embedding": self.embedding,
+            "index_version": self.index_version,
+        }
+        with open(path / (CENTROIDS_META_FILENAME + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        for name in (CENTROIDS_FILENAME, CENTROIDS_META_FILENAME):
+            (path / (name + ".tmp")).replace(path / name)
+
+    # --- Classification ---
+
+    def scores(self, vectors):
+        """(vectors, labels) cosine similarities of the vectors to each centroid."""
+        return unit_rows(vectors) @ self.centroids.T
+
+    def classify(self, vectors):
+        """Nearest category and its similarity for each of a batch of vectors."""
+        scores = self.scores(vectors)
+        best = scores.argmax(axis=1)
+        return [self.labels[i] for i in best], scores[np.arange(len(best)), best]
+
+    def classify_one(self, vector):
+        labels, scores = self.classify([vector])
+        return labels[0], float(scores[0])
+
+    def classify_together(self, vectors):
+        """One category for several vectors of the same text (e.g. a prompt and the chunks retrieved for it)."""
+        total = self.scores(vectors).sum(axis=0)
+        return self.labels[int(total.argmax())]
+
+
+def build_centroids(index_path, embedding=None, assessor=None):
+    """
+    Computes category centroids from a saved index. The labels come from weak_labels
+    on each chunk's text, and the vectors are the ones already stored in the index,
+    so nothing is embedded again.
+    """
+    start_time = time.time()
+    store = CompactVectorStore.load(index_path, None, mmap=True)
+    if ann_index.is_lossy(store.index):
+        logger.warning("The index stores product-quantized vectors; centroids are computed from approximations.")
+    texts = (store.chunk_text(row) for row in range(len(store.chunks)))
+    labels = weak_labels(texts, assessor)
+    vectors = ann_index.reconstruct_all(store.index)
+    classifier = CentroidClassifier.fit(vectors, labels, embedding=embedding, index_version=store.version)
+    logger.info(
+        f"Computed {len(classifier.labels)} clause centroids from {len(labels)} chunks in "
+        f"{time.time() - start_time:.2f}s (labeled chunks per category: {classifier.counts})."
+    )
+    return classifier
+
+
+if __name__ == "__main__":
+    import llm_providers
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Compute the embedding clause classifier's centroids for an existing index.")
+    parser.add_argument("--index", default="faiss_index", help="Index folder written by create_index.py.")
+    args = parser.parse_args()
+    build_centroids(args.index, embedding=llm_providers.embedding_model_name()).save(args.index)
+    logging.info(f"✅ Centroids saved to '{args.index}'.")
@@ -0,0 +1,358 @@
+import os
+import json
+import logging
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import ann_index
+import bm25_index
+import contract_metadata
+from bm25_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+# --- On-Disk Layout ---
+# index.faiss  FAISS index; vector i belongs to row i of chunks.npy (memory-mapped on load)
+# chunks.npy   one (file_id, offset, length) record per chunk; offset/length are UTF-8 byte
+#              positions inside that file's slice of corpus.bin (memory-mapped on load)
+# files.json   per-file name, source path, slice [blob_offset, blob_offset + blob_length) and
+#              metadata (agreement type, title, filer, date; see contract_metadata.py)
+# corpus.bin   UTF-8 text of every indexed file, packed back to back (memory-mapped on load)
+# bm25*        inverted index over the same chunk rows, for keyword search (see bm25_index.py)
+# Nothing is pickled, so loading an index never executes code from disk.
+INDEX_FILENAME = "index.faiss"
+CHUNKS_FILENAME = "chunks.npy"
+FILES_FILENAME = "files.json"
+CORPUS_FILENAME = "corpus.bin"
+LEGACY_FILENAMES = ("index.pkl",)  # LangChain FAISS.save_local docstore, no longer written or read
+
+CHUNK_DTYPE = np.dtype([("file_id", "<u4"), ("offset", "<u8"), ("length", "<u4")])
+FILTER_CACHE_SIZE = 64  # Row masks and FAISS selectors kept per distinct metadata filter
+
+# Rows admitted by a metadata filter: boolean row mask and FAISS search parameters. The
+# selector and bitmap the parameters point into travel with them, so they stay alive for as
+# long as anyone holds the tuple, even after it is evicted from the filter cache.
+RowFilter = namedtuple("RowFilter", ["mask", "params", "selector", "bitmap"])
+
+
+def read_index(path, mmap=True):
+    """
+    Reads a FAISS index. With `mmap`, vector storage stays in the OS page cache and is
+    shared by every process that maps the same file instead of being copied into each one.
+    """
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if mmap and flag is not None:
+        try:
+            return faiss.read_index(str(path), flag)
+        except RuntimeError as e:
+            logger.warning(f"Could not memory-map '{path}' ({e}); reading it into memory instead.")
+    return faiss.read_index(str(path))
+
+
+def _iter_chunk_texts(records, files, corpus):
+    """Decodes the text of each chunk record from a corpus blob."""
+    for record in records:
+        start = files[int(record["file_id"])]["blob_offset"] + int(record["offset"])
+        yield bytes(corpus[start:start + int(record["length"])]).decode("utf-8")
+
+
+class CompactVectorStore(VectorStore):
+    """
+    Read-only vector store over the compact on-disk format written by CompactStoreWriter.
+    Chunk text is sliced out of the memory-mapped corpus only for the results of a search.
+    `lexical` is the store's BM25 index, or None for stores saved before it existed.
+    """
+
+    def __init__(self, index, chunks, files, corpus, embedding, version=None, lexical=None):
+        self.index = index
+        self.chunks = chunks
+        self.files = files
+        self.corpus = corpus
+        self.embedding = embedding
+        self.version = version
+        self.lexical = lexical
+        # Stores saved before metadata was recorded get it parsed from the file names instead
+        self.file_metadata = [
+            file_info.get("metadata") or contract_metadata.parse_filename(file_info["name"]) for file_info in files
+        ]
+        self._filters = {}
+        self._filters_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, embedding, mmap=True, nprobe=None, ef_search=None):
+        """Opens a store saved by create_index.py. Query-time index parameters can be overridden."""
+        path = Path(path)
+        index = read_index(path / INDEX_FILENAME, mmap=mmap)
+        ann_index.set_search_params(index, nprobe, ef_search)
+        chunks = np.load(path / CHUNKS_FILENAME, mmap_mode="r" if mmap else None)
+        with open(path / FILES_FILENAME, "r", encoding="utf-8") as f:
+            files = json.load(f)
+        corpus_path = path / CORPUS_FILENAME
+        if os.path.getsize(corpus_path) == 0:
+            corpus = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            corpus = np.memmap(corpus_path, dtype=np.uint8, mode="r")
+        else:
+            corpus = np.fromfile(corpus_path, dtype=np.uint8)
+        lexical = BM25Index.load(path, mmap=mmap) if BM25Index.exists(path) else None
+        return cls(index, chunks, files, corpus, embedding, version=cls.current_version(path), lexical=lexical)
+
+    @classmethod
+    def current_version(cls, path):
+        """Identifies the saved index by the size and mtime of its files; changes on every save."""
+        stats = [os.stat(Path(path) / name) for name in (INDEX_FILENAME, CHUNKS_FILENAME)]
+        return "-".join(f"{s.st_mtime_ns:x}.{s.st_size:x}" for s in stats)
+
+    @classmethod
+    def exists(cls, path):
+        return all((Path(path) / name).exists() for name in (INDEX_FILENAME, CHUNKS_FILENAME, FILES_FILENAME, CORPUS_FILENAME))
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    # --- Chunk Access ---
+
+    def chunk_text(self, row):
+        """Decodes the text of one chunk from the corpus blob."""
+        record = self.chunks[row]
+        start = self.files[int(record["file_id"])]["blob_offset"] + int(record["offset"])
+        return bytes(self.corpus[start:start + int(record["length"])]).decode("utf-8")
+
+    def chunk_document(self, row):
+        record = self.chunks[row]
+        file_info = self.files[int(record["file_id"])]
+        metadata = {"source": file_info["source"], "row": int(row), "offset": int(record["offset"])}
+        metadata.update(self.file_metadata[int(record["file_id"])])
+        return Document(page_content=self.chunk_text(row), metadata=metadata)
+
+    def enable_chunk_vectors(self):
+        """Prepares the index for chunk_vectors; call once after loading, before serving searches."""
+        ann_index.enable_reconstruct(self.index)
+
+    def chunk_vectors(self, rows):
+        """Stored vectors of some chunks (approximations for PQ indexes), without embedding them again."""
+        return ann_index.reconstruct_rows(self.index, rows)
+
+    def file_text(self, file_id):
+        file_info = self.files[file_id]
+        start = file_info["blob_offset"]
+        return bytes(self.corpus[start:start + file_info["blob_length"]]).decode("utf-8")
+
+    # --- Metadata Filters ---
+
+    def _filter(self, filter):
+        """
+        Returns the RowFilter for a metadata filter (see contract_metadata.matches_filter), or
+        None for no filter. Cached per distinct filter; callers keep the returned tuple for
+        the duration of the search that uses it.
+        """
+        key = contract_metadata.filter_key(filter)
+        if key is None:
+            return None
+        with self._filters_lock:
+            cached = self._filters.get(key)
+        if cached is None:
+            file_ids = [i for i, metadata in enumerate(self.file_metadata) if contract_metadata.matches_filter(metadata, filter)]
+            mask = np.isin(self.chunks["file_id"], file_ids)
+            selector, bitmap = ann_index.row_selector(mask)
+            built = RowFilter(mask, ann_index.search_parameters(self.index, selector), selector, bitmap)
+            with self._filters_lock:
+                cached = self._filters.get(key)
+                if cached is None:
+                    if len(self._filters) >= FILTER_CACHE_SIZE:
+                        self._filters.pop(next(iter(self._filters)))
+                    cached = self._filters[key] = built
+        return cached
+
+    def count_rows(self, filter=None):
+        """Number of chunks a metadata filter admits."""
+        restriction = self._filter(filter)
+        return len(self.chunks) if restriction is None else int(restriction.mask.sum())
+
+    # --- Search ---
+
+    def _search(self, queries, k, filter=None):
+        """FAISS search, restricted to the rows of files matching `filter` if one is given."""
+        restriction = self._filter(filter)
+        if restriction is None:
+            return self.index.search(queries, k)
+        if not restriction.mask.any():
+            return np.full((len(queries), k), np.inf, dtype=np.float32), np.full((len(queries), k), -1, dtype=np.int64)
+        return self.index.search(queries, k, params=restriction.params)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        query = np.asarray([embedding], dtype=np.float32)
+        scores, rows = self._search(query, k, filter)
+        return [(self.chunk_document(row), float(score)) for row, score in zip(rows[0], scores[0]) if row != -1]
+
+    def search_rows(self, embeddings, k=4, filter=None):
+        """
+        Searches many query vectors in one FAISS call; returns one list of chunk rows per query.
+        With a metadata `filter`, only rows of matching files are scanned.
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.index.d)
+        _, rows = self._search(queries, k, filter)
+        return [[int(row) for row in query_rows if row != -1] for query_rows in rows]
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None):
+        """Searches many query vectors in one FAISS call; returns one result list per query."""
+        return [[self.chunk_document(row) for row in rows] for rows in self.search_rows(embeddings, k, filter)]
+
+    def keyword_search(self, query, k=4, filter=None):
+        """BM25 search over chunk text; returns (chunk row, score, term coverage) triples, best first."""
+        if self.lexical is None:
+            return []
+        restriction = self._filter(filter)
+        return self.lexical.search(query, k, mask=None if restriction is None else restriction.mask)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        # Same L2-to-relevance mapping that LangChain's FAISS store uses for unit-length vectors
+        return [(doc, 1.0 - score / np.sqrt(2)) for doc, score in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("CompactVectorStore is read-only. Run create_index.py to add documents.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Build a CompactVectorStore with create_index.py.")
+
+
+class CompactStoreWriter:
+    """
+    Builds the compact on-disk format. File text is appended to a temporary corpus blob as
+    soon as it is added, and vectors go into an exact flat index; `save` converts the index
+    to the requested type, builds the BM25 index over the same chunks and swaps the new
+    files into place.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.files = []
+        self.records = []
+        self.index = None
+        self._corpus_tmp = self.path / (CORPUS_FILENAME + ".tmp")
+        self._corpus = open(self._corpus_tmp, "wb")
+        self._corpus_size = 0
+
+    @classmethod
+    def from_existing(cls, path, embedding, drop_files=()):
+        """
+        Starts a writer from a saved store, keeping every file except `drop_files` (by name).
+        PQ indexes only hold approximate vectors, so their chunks are re-embedded instead
+        (normally all embedding cache hits).
+        """
+        store = CompactVectorStore.load(path, embedding, mmap=False)
+        drop_files = set(drop_files)
+        writer = cls(path)
+
+        file_map = {}
+        for old_id, file_info in enumerate(store.files):
+            if file_info["name"] not in drop_files:
+                file_map[old_id] = writer.add_file(
+                    file_info["name"], file_info["source"], store.file_text(old_id), store.file_metadata[old_id]
+                )
+
+        rows = np.array([row for row, record in enumerate(store.chunks) if int(record["file_id"]) in file_map], dtype=np.int64)
+        if len(rows):
+            if ann_index.is_lossy(store.index):
+                vectors = embedding.embed_documents([store.chunk_text(row) for row in rows])
+            else:
+                vectors = ann_index.reconstruct_all(store.index)[rows]
+            kept = store.chunks[rows]
+            file_ids = [file_map[int(file_id)] for file_id in kept["file_id"]]
+            writer.add_chunks(file_ids, kept["offset"], kept["length"], vectors)
+        return writer
+
+    @property
+    def file_names(self):
+        return [file_info["name"] for file_info in self.files]
+
+    def add_file(self, name, source, text, metadata=None):
+        """Appends a file's text to the corpus blob and returns its file id."""
+        data = text.encode("utf-8")
+        self._corpus.write(data)
+        self.files.append({
+            "name": name, "source": source, "blob_offset": self._corpus_size, "blob_length": len(data),
+            "metadata": metadata or contract_metadata.parse_filename(name),
+        })
+        self._corpus_size += len(data)
+        return len(self.files) - 1
+
+    def add_chunks(self, file_ids, offsets, lengths, vectors):
+        """Adds chunk records (byte positions within their file) and their vectors, in order."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = faiss.IndexFlatL2(vectors.shape[1])
+        self.index.add(vectors)
+        records = np.empty(len(file_ids), dtype=CHUNK_DTYPE)
+        records["file_id"] = file_ids
+        records["offset"] = offsets
+        records["length"] = lengths
+        self.records.append(records)
+
+    def chunk_counts(self):
+        """Number of chunks stored per file name."""
+        counts = dict.fromkeys(self.file_names, 0)
+        for records in self.records:
+            for file_id, n in zip(*np.unique(records["file_id"], return_counts=True)):
+                counts[self.files[int(file_id)]["name"]] += int(n)
+        return counts
+
+    def save(self, index_type="flat", index_params=None):
+        """Writes the index, chunk table and file list next to the corpus blob and swaps them in."""
+        index_params = index_params or {}
+        if self.index is None or self.index.ntotal == 0:
+            raise ValueError("No chunks were added; refusing to save an empty index.")
+        self._corpus.close()
+
+        index = self.index
+        if index_type != "flat":
+            logger.info(f"Converting the index to '{index_type}' over {index.ntotal} vectors...")
+            index = ann_index.convert_index(index, index_type, **index_params)
+        ann_index.set_search_params(index, index_params.get("nprobe"), index_params.get("ef_search"))
+
+        records = np.concatenate(self.records)
+        tmp = {name: self.path / (name + ".tmp") for name in (INDEX_FILENAME, CHUNKS_FILENAME, FILES_FILENAME)}
+        faiss.write_index(index, str(tmp[INDEX_FILENAME]))
+        with open(tmp[CHUNKS_FILENAME], "wb") as f:
+            np.save(f, records)
+        with open(tmp[FILES_FILENAME], "w", encoding="utf-8") as f:
+            json.dump(self.files, f)
+
+        # Re-tokenizing every chunk takes seconds, so the keyword index is simply rebuilt each save
+        corpus = np.memmap(self._corpus_tmp, dtype=np.uint8, mode="r") if self._corpus_size else np.zeros(0, dtype=np.uint8)
+        BM25Index.build(_iter_chunk_texts(records, self.files, corpus)).save(self.path, suffix=".tmp")
+        del corpus
+        tmp.update({name: self.path / (name + ".tmp") for name in bm25_index.FILENAMES})
+
+        # Processes that already mapped the old files keep reading them until they reload
+        os.replace(self._corpus_tmp, self.path / CORPUS_FILENAME)
+        for name, tmp_path in tmp.items():
+            os.replace(tmp_path, self.path / name)
+        for name in LEGACY_FILENAMES:
+            legacy = self.path / name
+            if legacy.exists():
+                legacy.unlink()
+
+    def abort(self):
+        """Discards the temporary corpus blob without touching the saved store."""
+        self._corpus.close()
+        if self._corpus_tmp.exists():
+            self._corpus_tmp.unlink()
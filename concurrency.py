@@ -0,0 +1,93 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a ConcurrencyLimiter already has as many callers queued as it allows."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many requests queued; retry after {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of concurrent async operations at `limit`. Up to `max_waiting` further
+    callers queue for a slot; beyond that, callers are rejected at once with QueueFullError
+    (carrying a Retry-After hint) instead of piling up behind a slow upstream.
+    One instance belongs to one event loop.
+    """
+
+    def __init__(self, limit: int, max_waiting: int, retry_after: int = 5):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def is_full(self) -> bool:
+        """True if a new caller would be rejected right now."""
+        return self._semaphore.locked() and self.waiting >= self.max_waiting
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.is_full():
+            self.rejected += 1
+            raise QueueFullError(self.retry_after)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_waiting": self.max_waiting,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the computation and
+    every caller arriving while it is in flight awaits the same result (or exception) instead
+    of starting its own. Nothing is kept once the computation finishes, so this dedupes
+    bursts, not repeats; caching stays with the caches. The computation runs as its own
+    task, so a caller that disconnects does not cancel it for the others.
+    One instance belongs to one event loop.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, compute):
+        """Returns the result of `await compute()`, shared with concurrent callers using `key`."""
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
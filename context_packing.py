@@ -0,0 +1,110 @@
+import re
+import math
+from collections import namedtuple
+
+# --- Packing Constants ---
+CHARS_PER_TOKEN = 4        # Gemini averages about four characters of English per token
+SHINGLE_SIZE = 5           # Words per shingle when comparing passages
+DUPLICATE_SIMILARITY = 0.8  # Shingle Jaccard similarity above which a passage is a near-duplicate
+MIN_PARTIAL_TOKENS = 64    # Smallest remainder of the budget worth filling with a truncated passage
+
+WORD_RE = re.compile(r"\w+")
+
+# Text of one or more merged chunks; `rank` is the best retrieval rank among them
+Passage = namedtuple("Passage", ["text", "source", "start", "end", "rank"])
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate, so packing needs no tokenizer round-trip."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _passage(doc, rank):
+    start = doc.metadata.get("offset")
+    end = None if start is None else start + len(doc.page_content.encode("utf-8"))
+    return Passage(doc.page_content, doc.metadata.get("source"), start, end, rank)
+
+
+def merge_neighbors(passages):
+    """
+    Merges passages from the same source whose byte ranges overlap or touch, so the overlap
+    between consecutive chunks is sent once. Passages without a position are kept as they are.
+    """
+    positioned, others = {}, []
+    for passage in passages:
+        if passage.source is None or passage.start is None:
+            others.append(passage)
+        else:
+            positioned.setdefault(passage.source, []).append(passage)
+
+    merged = list(others)
+    for group in positioned.values():
+        group.sort(key=lambda p: p.start)
+        current = group[0]
+        for passage in group[1:]:
+            if passage.start > current.end:
+                merged.append(current)
+                current = passage
+            elif passage.end <= current.end:
+                current = current._replace(rank=min(current.rank, passage.rank))
+            else:
+                # Chunk boundaries are character boundaries, so the byte cut decodes cleanly
+                tail = passage.text.encode("utf-8")[current.end - passage.start:].decode("utf-8")
+                current = Passage(current.text + tail, current.source, current.start, passage.end,
+                                  min(current.rank, passage.rank))
+        merged.append(current)
+    return sorted(merged, key=lambda p: p.rank)
+
+
+def _shingles(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def drop_near_duplicates(passages, threshold=DUPLICATE_SIMILARITY):
+    """
+    Drops passages whose word shingles mostly match a better-ranked passage's, as with the
+    same template contract filed by several companies. Expects passages in rank order.
+    """
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage.text)
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def _truncate(text, max_tokens, count_tokens):
+    """Longest prefix of `text` ending at a word boundary that fits in `max_tokens`."""
+    cut = min(len(text), max_tokens * CHARS_PER_TOKEN)
+    while cut > 0:
+        space = text.rfind(" ", 0, cut)
+        cut = space if space > 0 else 0
+        if cut and count_tokens(text[:cut].rstrip() + " ...") <= max_tokens:
+            return text[:cut].rstrip() + " ..."
+    return ""
+
+
+def pack_context(docs, token_budget, count_tokens=estimate_tokens):
+    """
+    Turns retrieved chunks (best first) into passages that fit in `token_budget` tokens:
+    neighbouring chunks are merged, near-duplicates dropped, and passages are added in rank
+    order until the budget is spent, truncating the last one if enough room is left.
+    """
+    passages = drop_near_duplicates(merge_neighbors([_passage(doc, rank) for rank, doc in enumerate(docs)]))
+    packed, remaining = [], token_budget
+    for passage in passages:
+        tokens = count_tokens(passage.text)
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+        elif remaining >= MIN_PARTIAL_TOKENS:
+            text = _truncate(passage.text, remaining, count_tokens)
+            if text:
+                packed.append(passage._replace(text=text))
+                remaining -= count_tokens(text)
+    return packed
@@ -0,0 +1,123 @@
+import re
+from datetime import date
+
+# --- CUAD Filename Formats ---
+# "BLACKBOXSTOCKSINC_08_05_2014-EX-10.1-DISTRIBUTOR AGREEMENT.txt"          filer, MM_DD_YYYY, exhibit, title
+# "WebmdHealthCorp_20050908_S-1A_EX-10.7_1027007_EX-10.7_Content License Agreement.txt"
+#                                                                           filer, YYYYMMDD, form, exhibit, title
+# "Antares Pharma, Inc. - Manufacturing Agreement.txt"                      filer, title (no date)
+DASHED_DATE_RE = re.compile(r"^(?P<filer>.+?)_(?P<month>\d{2})_(?P<day>\d{2})_(?P<year>\d{4})-EX[^-]*-[^-]*-(?P<title>.*)$")
+COMPACT_DATE_RE = re.compile(r"^(?P<filer>.+?)_(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})_[^_]+_EX[^_]*_\d+_EX[^_]*_(?P<title>.+)$")
+NAMED_RE = re.compile(r"^(?P<filer>.+?)\s+-\s+(?P<title>.+)$")
+
+# The CUAD agreement categories, keyed by the words that identify them in a title. A title
+# that names several ("Manufacturing and Supply Agreement") gets the one mentioned first.
+AGREEMENT_TYPE_PATTERNS = {
+    "affiliate": r"affiliate",
+    "agency": r"agency",
+    "collaboration": r"collaborat|cooperat",
+    "co-branding": r"co-?branding",
+    "consulting": r"consult",
+    "development": r"development",
+    "distributor": r"distribut",
+    "endorsement": r"endorsement",
+    "franchise": r"franchise",
+    "hosting": r"hosting",
+    "ip": r"intellectual property|\bip\b",
+    "joint venture": r"joint venture",
+    "license": r"licens",
+    "maintenance": r"maintenance|support",
+    "manufacturing": r"manufactur",
+    "marketing": r"marketing",
+    "non-compete": r"non[- ]?compet",
+    "outsourcing": r"outsourc",
+    "promotion": r"promotion",
+    "reseller": r"reseller",
+    "service": r"servic",
+    "sponsorship": r"sponsor",
+    "strategic alliance": r"strategic alliance",
+    "supply": r"supply",
+    "transportation": r"transport",
+}
+AGREEMENT_TYPE_RE = re.compile("|".join(f"(?P<t{i}>{pattern})" for i, pattern in enumerate(AGREEMENT_TYPE_PATTERNS.values())))
+AGREEMENT_TYPES = tuple(AGREEMENT_TYPE_PATTERNS)
+OTHER_TYPE = "other"
+
+
+def classify_title(title):
+    """Maps an agreement title to one of AGREEMENT_TYPES, or OTHER_TYPE."""
+    match = AGREEMENT_TYPE_RE.search(title.lower())
+    if match is None:
+        return OTHER_TYPE
+    return AGREEMENT_TYPES[int(match.lastgroup[1:])]
+
+
+def normalize_agreement_type(value):
+    """
+    Accepts "Distributor", "DISTRIBUTOR AGREEMENT", "joint_venture", ... and returns the
+    category. Values naming no category come back cleaned up but otherwise unchanged.
+    """
+    value = re.sub(r"[\s_]+", " ", value).strip().lower()
+    value = re.sub(r"\s*agreements?$", "", value)
+    if value in AGREEMENT_TYPES or value == OTHER_TYPE:
+        return value
+    category = classify_title(value)
+    return value if category == OTHER_TYPE else category
+
+
+def parse_filename(name):
+    """
+    Extracts agreement type, title, filer and filing date (ISO format, or None) from a CUAD
+    contract filename. Names in no known format keep the whole stem as their title.
+    """
+    stem = re.sub(r"\.txt$", "", name, flags=re.IGNORECASE).strip()
+    filer, filed, title = None, None, stem
+    match = DASHED_DATE_RE.match(stem) or COMPACT_DATE_RE.match(stem)
+    named = NAMED_RE.match(stem)
+    if match:
+        filer, title = match["filer"], match["title"] or stem
+        try:
+            filed = date(int(match["year"]), int(match["month"]), int(match["day"])).isoformat()
+        except ValueError:
+            filed = None
+    elif named:
+        filer, title = named["filer"], named["title"]
+    title = re.sub(r"\s+", " ", title).strip()
+    return {"agreement_type": classify_title(title), "title": title, "filer": filer, "date": filed}
+
+
+def matches_filter(metadata, filter):
+    """
+    True if a file's metadata passes a retrieval filter. Supported keys, all optional:
+    agreement_type (one or a list), filer (case-insensitive substring), date_from and
+    date_to (inclusive ISO dates; files without a date never match a date bound).
+    """
+    types = filter.get("agreement_type")
+    if types:
+        types = [types] if isinstance(types, str) else types
+        if metadata["agreement_type"] not in {normalize_agreement_type(t) for t in types}:
+            return False
+    filer = filter.get("filer")
+    if filer and filer.casefold() not in (metadata.get("filer") or "").casefold():
+        return False
+    filed = metadata.get("date")
+    if filter.get("date_from") and (filed is None or filed < filter["date_from"]):
+        return False
+    if filter.get("date_to") and (filed is None or filed > filter["date_to"]):
+        return False
+    return True
+
+
+def filter_key(filter):
+    """Hashable, order-independent form of a filter for cache keys; None for no filter."""
+    if not filter:
+        return None
+    items = []
+    for key, value in sorted(filter.items()):
+        if value in (None, "", []):
+            continue
+        if key == "agreement_type":
+            value = [value] if isinstance(value, str) else value
+            value = tuple(sorted({normalize_agreement_type(v) for v in value}))
+        items.append((key, value))
+    return tuple(items) or None
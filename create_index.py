@@ -1,6 +1,10 @@
 import os
+import json
 import time
 import logging
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -8,9 +12,15 @@ from tqdm import tqdm
 
 # --- LangChain Imports ---
 from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_core.documents import Document
+
+import ann_index
+import chunker
+import clause_classifier
+from bm25_index import BM25Index
+from compact_store import CompactStoreWriter, CompactVectorStore
+from file_hashing import file_sha256
+import llm_providers
 
 # --- Configuration ---
 # Configure logging to print status updates to the console
@@ -22,66 +32,261 @@ load_dotenv()
 # --- Script Constants (modify these to change behavior) ---
 SOURCE_DOCUMENTS_PATH = "full_contract_txt"
 FAISS_INDEX_SAVE_PATH = "faiss_index"
+MANIFEST_FILENAME = "manifest.json"  # Stored inside the index folder
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 100  # Chunks sent per embedding request
+MAX_IN_FLIGHT = 4       # Embedding requests allowed to run at the same time
+INDEX_TYPE = "flat"     # One of ann_index.INDEX_TYPES: flat, ivf_flat, ivf_pq, hnsw
+INDEX_PARAMS = {}       # Overrides for ann_index.DEFAULT_PARAMS (nlist, nprobe, hnsw_m, ef_search, ...)
+
+
+def iter_chunks(files, writer, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Loads and splits one file at a time with the section-aware chunker, yielding its chunks
+    before the next file is read. Each file's text is handed to the writer's corpus blob,
+    and each chunk records its file id and UTF-8 byte span within that file.
+    """
+    for file in files:
+        text = TextLoader(str(file), encoding="utf-8").load()[0].page_content
+        file_id = writer.add_file(file.name, str(file), text)
+
+        char_pos = byte_pos = 0
+        for chunk in chunker.iter_chunks(text, chunk_size, chunk_overlap):
+            # Chunk starts only move forward, so byte offsets can be accumulated incrementally
+            byte_pos += len(text[char_pos:chunk.start].encode("utf-8"))
+            char_pos = chunk.start
+            metadata = {"file_id": file_id, "offset": byte_pos, "length": len(chunk.text.encode("utf-8"))}
+            yield Document(page_content=chunk.text, metadata=metadata)
+
+
+def load_manifest(index_path):
+    """Loads the manifest of indexed files, or returns None if there is none."""
+    manifest_path = Path(index_path) / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(index_path, manifest):
+    """Writes the manifest next to the index, replacing the old one atomically."""
+    manifest_path = Path(index_path) / MANIFEST_FILENAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_manifest(manifest, file_hashes):
+    """
+    Compares the manifest with the files currently on disk.
+    Returns the names of new, changed and deleted files.
+    """
+    indexed = manifest.get("files", {})
+    new = [name for name in file_hashes if name not in indexed]
+    changed = [name for name in file_hashes if name in indexed and indexed[name]["sha256"] != file_hashes[name]]
+    deleted = [name for name in indexed if name not in file_hashes]
+    return new, changed, deleted
+
+
+def iter_batches(items, batch_size):
+    """Groups an iterable into lists of at most `batch_size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _embed_batch(embeddings, batch):
+    """Embeds the text of a batch of chunks. Runs on a worker thread."""
+    return batch, embeddings.embed_documents([chunk.page_content for chunk in batch])
+
+
+def _add_batch(writer, future):
+    """Waits for an embedding request and adds its vectors and chunk records to the writer."""
+    batch, vectors = future.result()
+    writer.add_chunks(
+        [chunk.metadata["file_id"] for chunk in batch],
+        [chunk.metadata["offset"] for chunk in batch],
+        [chunk.metadata["length"] for chunk in batch],
+        vectors,
+    )
+    return len(batch)
+
+
+def build_index_streaming(chunks, embeddings, writer, batch_size=EMBED_BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Embeds chunks in batches with at most `max_in_flight` requests outstanding and adds
+    each batch to the writer's index as soon as it is ready.
 
-def create_faiss_index():
+    Batches are added in submission order, so the resulting index is identical to a
+    serial build. Returns the number of chunks indexed.
     """
-    Reads documents, creates embeddings, builds a FAISS index, and saves it to disk.
+    total_chunks = 0
+    in_flight = deque()
+    progress = tqdm(desc="🧮 Embedding Chunks", unit="chunk")
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for batch in iter_batches(chunks, batch_size):
+            # Bound the number of outstanding requests (and buffered chunks) before submitting more
+            if len(in_flight) >= max_in_flight:
+                progress.update(_add_batch(writer, in_flight.popleft()))
+            in_flight.append(pool.submit(_embed_batch, embeddings, batch))
+            total_chunks += len(batch)
+
+        while in_flight:
+            progress.update(_add_batch(writer, in_flight.popleft()))
+
+    progress.close()
+    return total_chunks
+
+
+def save_centroids(index_path, embedding_model):
+    """Recomputes the embedding clause classifier's centroids from the saved index (see clause_classifier.py)."""
+    try:
+        clause_classifier.build_centroids(index_path, embedding=embedding_model).save(index_path)
+    except ValueError as e:
+        logging.warning(f"Could not compute clause centroids: {e}")
+
+
+def create_faiss_index(full_rebuild=False, index_type=None, index_params=None):
+    """
+    Streams documents through chunking and batched embedding into a FAISS index and saves it to
+    disk in the compact format read by compact_store.CompactVectorStore.
+
+    If a previous index and its manifest exist (and `full_rebuild` is False), only new or
+    changed files are embedded, and the vectors of changed or deleted files are removed.
+
+    Vectors are collected in an exact flat index and converted to `index_type` (see
+    ann_index.INDEX_TYPES) when saving, since IVF indexes need training data. Without an
+    `index_type`, an existing index keeps the type and parameters recorded in its manifest;
+    `index_params` override individual parameters. Changing them re-saves the index from
+    its stored vectors without re-embedding anything.
     """
-    # 1. --- Loading & Chunking ---
+    # 1. --- File Discovery ---
     logging.info(f"Looking for source documents in '{SOURCE_DOCUMENTS_PATH}'...")
     source_path = Path(SOURCE_DOCUMENTS_PATH)
     if not source_path.exists() or not any(source_path.iterdir()):
         logging.error(f"Source directory '{SOURCE_DOCUMENTS_PATH}' is missing or empty. Aborting.")
         return
 
-    files = list(source_path.glob("*.txt"))
+    files = sorted(source_path.glob("*.txt"))
     logging.info(f"Found {len(files)} documents to process.")
-
-    # Load all documents with a progress bar
-    docs = []
-    for file in tqdm(files, desc="📚 Loading Documents"):
-        loader = TextLoader(str(file), encoding="utf-8")
-        docs.extend(loader.load())
-
-    # Split the documents into smaller chunks
-    logging.info(f"Splitting {len(docs)} loaded pages into text chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    chunks = text_splitter.split_documents(docs)
-    logging.info(f"Successfully created {len(chunks)} text chunks.")
+    file_hashes = {file.name: file_sha256(file) for file in files}
 
     # 2. --- Embedding ---
-    logging.info("Initializing Google Generative AI Embeddings model...")
+    embedding_model = llm_providers.embedding_model_name()
+    logging.info(f"Initializing the '{embedding_model}' embeddings model...")
     try:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables.")
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
+        # Chunks embedded by an earlier run (or duplicated across files) are served from disk
+        embeddings = llm_providers.cached_embedding_model()
     except Exception as e:
         logging.error(f"Failed to initialize embeddings model: {e}")
         return
 
-    # 3. --- Indexing & Saving ---
-    logging.info("Starting the creation of the FAISS vector index. This may take several minutes...")
+    # 3. --- Work Out What Needs (Re-)Indexing ---
+    manifest = None if full_rebuild else load_manifest(FAISS_INDEX_SAVE_PATH)
+    # Manifests written before the index settings were recorded all describe flat indexes
+    previous_index = (manifest or {}).get("index") or {"type": INDEX_TYPE, "params": INDEX_PARAMS}
+    index_type = index_type or previous_index["type"]
+    base_params = previous_index["params"] if index_type == previous_index["type"] else INDEX_PARAMS
+    index_params = {**base_params, **(index_params or {})}
+    index_settings = {"type": index_type, "params": index_params}
+    if manifest is not None and not CompactVectorStore.exists(FAISS_INDEX_SAVE_PATH):
+        logging.info("Existing index is not in the compact format; rebuilding it from scratch.")
+        manifest = None
+    chunking = {"chunker": "section", "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+    if manifest is not None and manifest.get("chunking") != chunking:
+        logging.info("Chunking settings changed since the last run; rebuilding the index from scratch.")
+        manifest = None
+    # Manifests written before the model was recorded were all built with Gemini's embedding-001
+    if manifest is not None and manifest.get("embedding", "models/embedding-001") != embedding_model:
+        logging.info("The embedding model changed since the last run; rebuilding the index from scratch.")
+        manifest = None
+
+    if manifest is not None:
+        new, changed, deleted = diff_manifest(manifest, file_hashes)
+        logging.info(f"Incremental update: {len(new)} new, {len(changed)} changed, {len(deleted)} deleted files.")
+        settings_changed = previous_index != index_settings
+        if settings_changed:
+            logging.info(f"Index settings changed to {index_settings}; re-saving the index from its stored vectors.")
+        if not (new or changed or deleted or settings_changed) and BM25Index.exists(FAISS_INDEX_SAVE_PATH):
+            if not clause_classifier.CentroidClassifier.exists(FAISS_INDEX_SAVE_PATH):
+                save_centroids(FAISS_INDEX_SAVE_PATH, embedding_model)
+            logging.info("✅ Index is already up to date. Nothing to do.")
+            return
+
+        # Unchanged files are carried over into a fresh flat index; changed and deleted ones are dropped
+        logging.info(f"Carrying over unchanged documents and dropping {len(changed) + len(deleted)} stale ones...")
+        writer = CompactStoreWriter.from_existing(FAISS_INDEX_SAVE_PATH, embeddings, drop_files=changed + deleted)
+        for name in deleted:
+            del manifest["files"][name]
+
+        to_index = set(new + changed)
+        files = [file for file in files if file.name in to_index]
+    else:
+        logging.info("No manifest found (or full rebuild requested). Building the index from scratch.")
+        manifest = {"files": {}}
+        writer = CompactStoreWriter(FAISS_INDEX_SAVE_PATH)
+
+    # 4. --- Streaming Chunking, Embedding & Indexing ---
+    logging.info(
+        f"Embedding {len(files)} documents (batch size {EMBED_BATCH_SIZE}, "
+        f"{MAX_IN_FLIGHT} concurrent requests)..."
+    )
     start_time = time.time()
 
     try:
-        # This is the core step that creates the index from all chunks and their embeddings
-        db = FAISS.from_documents(chunks, embeddings)
+        total_chunks = build_index_streaming(iter_chunks(files, writer), embeddings, writer)
     except Exception as e:
         logging.error(f"An error occurred during FAISS index creation: {e}")
+        writer.abort()
         return
 
     end_time = time.time()
     elapsed_time = end_time - start_time
-    logging.info(f"FAISS index created successfully in {elapsed_time:.2f} seconds.")
+    logging.info(f"Indexed {total_chunks} chunks in {elapsed_time:.2f} seconds.")
+
+    manifest["index"] = index_settings
+    manifest["chunking"] = chunking
+    manifest["embedding"] = embedding_model
+    chunk_counts = writer.chunk_counts()
+    for file in files:
+        manifest["files"][file.name] = {"sha256": file_hashes[file.name], "chunks": chunk_counts[file.name]}
 
-    # Save the newly created index to the local disk
+    # Save the index first; the manifest is only written once the index it describes is on disk
     logging.info(f"Saving index to disk at '{FAISS_INDEX_SAVE_PATH}'...")
-    db.save_local(FAISS_INDEX_SAVE_PATH)
+    try:
+        writer.save(index_type, index_params)
+    except ValueError as e:
+        logging.error(f"Could not save the index: {e}")
+        writer.abort()
+        return
+    save_manifest(FAISS_INDEX_SAVE_PATH, manifest)
+    save_centroids(FAISS_INDEX_SAVE_PATH, embedding_model)
     logging.info("✅ Index saved successfully. You can now use this in your Streamlit app.")
 
 
 if __name__ == "__main__":
-    create_faiss_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build or incrementally update the FAISS contract index.")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-embed every document.")
+    parser.add_argument(
+        "--index-type", choices=ann_index.INDEX_TYPES,
+        help=f"FAISS index structure to build (default: the existing index's type, or {INDEX_TYPE}).",
+    )
+    parser.add_argument("--nlist", type=int, help="IVF: number of k-means cells.")
+    parser.add_argument("--nprobe", type=int, help="IVF: cells scanned per query.")
+    parser.add_argument("--pq-m", type=int, help="IVF-PQ: number of sub-quantizers.")
+    parser.add_argument("--pq-nbits", type=int, help="IVF-PQ: bits per code.")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW: neighbours per node.")
+    parser.add_argument("--ef-construction", type=int, help="HNSW: build-time search depth.")
+    parser.add_argument("--ef-search", type=int, help="HNSW: query-time search depth.")
+    args = parser.parse_args()
+
+    cli_params = {key: getattr(args, key) for key in ann_index.DEFAULT_PARAMS if getattr(args, key) is not None}
+    create_faiss_index(full_rebuild=args.full, index_type=args.index_type, index_params=cli_params)
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import bisect
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+import numpy as np
+
+import chunker
+from vector_math import unit_rows
+
+logger = logging.getLogger(__name__)
+
+# --- Document Index Settings ---
+DOCUMENT_CHUNK_SIZE = chunker.CHUNK_SIZE  # Same chunking as the corpus index
+DOCUMENT_CHUNK_OVERLAP = chunker.CHUNK_OVERLAP
+DOCUMENT_CACHE_MAX_DOCUMENTS = int(os.getenv("DOCUMENT_CACHE_MAX_DOCUMENTS", "64"))
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_MB", "256")) * 1024 * 1024
+PAGE_SEPARATOR = "\n\n"  # Pages are joined on a paragraph break, so chunks prefer to end at one
+# Page text of every uploaded document, so any worker process can rebuild an index it does not
+# hold; the vectors come back from the shared on-disk embedding cache. Not served under /temp.
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", "uploaded_documents")
+DOCUMENT_ID_RE = re.compile(r"[0-9a-f]{64}")  # SHA-256 hex digest
+
+# A search hit: chunk text, the first and last page it comes from (1-based), cosine similarity
+Passage = namedtuple("Passage", ["text", "first_page", "last_page", "score"])
+
+
+class DocumentIndex:
+    """
+    Vector index over the chunks of one uploaded document, identified by the SHA-256 of its
+    content. A single document has at most a few thousand chunks, so the unit-length vectors
+    are kept in one matrix and searched exactly with a matrix-vector product, like
+    semantic_cache.py; scores are cosine similarities. Chunks remember the pages they were
+    cut from.
+    """
+
+    def __init__(self, document_id, chunks, page_starts, vectors):
+        self.document_id = document_id
+        self.chunks = chunks
+        self.page_starts = page_starts
+        self.vectors = unit_rows(np.asarray(vectors, dtype=np.float32).reshape(len(chunks), -1))
+
+    @property
+    def pages(self):
+        return len(self.page_starts)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held: the vectors plus the chunk text."""
+        return self.vectors.nbytes + sum(len(chunk.text) for chunk in self.chunks)
+
+    def page_of(self, offset):
+        """1-based page of a character offset in the joined document text."""
+        return bisect.bisect_right(self.page_starts, offset)
+
+    def search(self, vector, k=4):
+        """The `k` chunks most similar to a query vector, best first."""
+        scores = self.vectors @ unit_rows(vector)[0]
+        k = min(k, len(scores))
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [
+            Passage(self.chunks[row].text, self.page_of(self.chunks[row].start), self.page_of(self.chunks[row].end - 1), float(scores[row]))
+            for row in rows
+        ]
+
+
+def chunk_pages(pages, chunk_size=DOCUMENT_CHUNK_SIZE, chunk_overlap=DOCUMENT_CHUNK_OVERLAP):
+    """Section-aware chunks of a document given page by page; returns (chunks, page start offsets)."""
+    page_starts, offset = [], 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page) + len(PAGE_SEPARATOR)
+    return list(chunker.iter_chunks(PAGE_SEPARATOR.join(pages), chunk_size, chunk_overlap)), page_starts
+
+
+def _pages_path(document_id, store_dir):
+    return Path(store_dir) / f"{document_id}.json"
+
+
+def save_pages(document_id, pages, store_dir=DOCUMENT_STORE_DIR):
+    """Saves a document's page text under its id, replacing the file atomically."""
+    path = _pages_path(document_id, store_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pages, f)
+    os.replace(tmp_path, path)
+
+
+def load_pages(document_id, store_dir=DOCUMENT_STORE_DIR):
+    """The page text saved for a document, or None if it was never uploaded (or the id is malformed)."""
+    if not DOCUMENT_ID_RE.fullmatch(document_id):
+        return None
+    try:
+        with open(_pages_path(document_id, store_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+async def build_document_index(document_id, pages, embeddings, chunk_size=DOCUMENT_CHUNK_SIZE, chunk_overlap=DOCUMENT_CHUNK_OVERLAP):
+    """
+    Chunks a document and embeds every chunk in one request through `embeddings` (the shared
+    cached model, so a document seen before is not sent to the provider again). Returns None
+    if the document has no text.
+    """
+    chunks, page_starts = chunk_pages(pages, chunk_size, chunk_overlap)
+    if not chunks:
+        return None
+    vectors = await embeddings.aembed_documents([chunk.text for chunk in chunks])
+    return DocumentIndex(document_id, chunks, page_starts, vectors)
+
+
+class DocumentIndexCache:
+    """
+    Thread-safe LRU cache of document indexes, bounded both by count (`max_documents`) and by
+    approximate memory (`max_bytes`); the least recently used indexes are evicted until both
+    hold. An index larger than the whole budget is not cached at all. Keeps hit, miss and
+    eviction counters.
+    """
+
+    def __init__(self, max_documents: int = DOCUMENT_CACHE_MAX_DOCUMENTS, max_bytes: int = DOCUMENT_CACHE_MAX_BYTES):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, document_id):
+        with self._lock:
+            index = self._data.get(document_id)
+            if index is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(document_id)
+            self.hits += 1
+            return index
+
+    def put(self, index):
+        """Caches an index as the most recently used one; returns whether it was cached."""
+        if index.nbytes > self.max_bytes or not self.max_documents:
+            logger.warning(f"Index of document {index.document_id[:12]} ({index.nbytes} bytes) exceeds the cache budget; not caching it.")
+            return False
+        with self._lock:
+            previous = self._data.pop(index.document_id, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._data[index.document_id] = index
+            self.nbytes += index.nbytes
+            while len(self._data) > self.max_documents or self.nbytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_documents": self.max_documents,
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,16 +1,22 @@
-import os
+import json
 import time
 import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
 from pathlib import Path
+from queue import Empty
 
+import numpy as np
 from dotenv import load_dotenv
-from tqdm import tqdm
 
 # --- LangChain Imports ---
 from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import chunker
+from compact_store import CompactStoreWriter
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,82 +24,202 @@ load_dotenv()
 
 # --- Script Constants ---
 SOURCE_DOCUMENTS_PATH = "full_contract_txt"
-SAMPLE_SIZE = 5  # <--- We will only process the first 5 files
+CORPUS_SIZES = [10, 50, 100, 0]  # Number of files per run; 0 means every file
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 100
+EMBEDDING_DIM = 768  # Same as models/embedding-001
+STAGES = ["load", "split", "embed", "index_add", "save"]
+CHILD_POLL_S = 1.0  # How often the parent checks that a benchmark process is still running
+
 
-def estimate_indexing_time():
+class LocalEmbeddings(DeterministicFakeEmbedding):
     """
-    Processes a sample of documents to estimate the total time required for full indexing.
+    Offline stand-in for the Gemini embedder: vectors are a deterministic function of the text,
+    and an optional fixed delay per request models the network round-trip.
     """
-    # --- 1. File Discovery ---
-    logging.info("Scanning source directory to count total files...")
-    source_path = Path(SOURCE_DOCUMENTS_PATH)
-    if not source_path.exists():
-        logging.error(f"Source directory '{SOURCE_DOCUMENTS_PATH}' is missing. Aborting.")
-        return
 
-    all_files = sorted(list(source_path.glob("*.txt"))) # Sort for consistency
-    total_files = len(all_files)
+    latency_s: float = 0.0
 
-    if total_files == 0:
-        logging.error(f"No .txt files found in '{SOURCE_DOCUMENTS_PATH}'. Aborting.")
-        return
-        
-    # Adjust sample size if there are fewer files than the desired sample size
-    actual_sample_size = min(total_files, SAMPLE_SIZE)
-    sample_files = all_files[:actual_sample_size]
-    
-    logging.info(f"Found {total_files} total documents. Processing a sample of {len(sample_files)} files.")
-
-    # --- 2. Loading & Chunking Sample ---
-    docs = []
-    for file in tqdm(sample_files, desc=f"📚 Loading {len(sample_files)} Sample Files"):
-        loader = TextLoader(str(file), encoding="utf-8")
-        docs.extend(loader.load())
-
-    logging.info(f"Splitting sample documents into text chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    chunks = text_splitter.split_documents(docs)
-    logging.info(f"Created {len(chunks)} text chunks from the sample.")
-
-    # --- 3. Embedding & Indexing Sample ---
-    logging.info("Initializing Google Generative AI Embeddings model...")
-    try:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables.")
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
-    except Exception as e:
-        logging.error(f"Failed to initialize embeddings model: {e}")
-        return
+    def embed_documents(self, texts):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return super().embed_documents(texts)
+
+
+def make_embedder(kind, latency_ms=0.0):
+    if kind == "local":
+        return LocalEmbeddings(size=EMBEDDING_DIM, latency_s=latency_ms / 1000)
+    # The configured provider (Gemini, or e.g. mock_llm_server.py), uncached, for comparison with the local numbers
+    import llm_providers
+    return llm_providers.embedding_model()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies, items, elapsed):
+    """Throughput and latency percentiles for one stage."""
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "items": items,
+        "seconds": elapsed,
+        "per_second": items / elapsed if elapsed else float("inf"),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
 
-    logging.info(f"Starting FAISS index creation for the {len(sample_files)}-file sample...")
-    start_time = time.time()
 
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def split_file(text):
+    """Section-aware chunks of one file as (UTF-8 byte offset, byte length, text), as create_index.py records them."""
+    chunks, char_pos, byte_pos = [], 0, 0
+    for chunk in chunker.iter_chunks(text, CHUNK_SIZE, CHUNK_OVERLAP):
+        byte_pos += len(text[char_pos:chunk.start].encode("utf-8"))
+        char_pos = chunk.start
+        chunks.append((byte_pos, len(chunk.text.encode("utf-8")), chunk.text))
+    return chunks
+
+
+def run_pipeline(files, embedder_kind, latency_ms):
+    """
+    Runs every indexing stage over `files`, one stage at a time so each is measured alone.
+    Returns per-stage statistics and the peak RSS of the process.
+    """
+    embeddings = make_embedder(embedder_kind, latency_ms)
+    stats = {}
+
+    # 1. File load (one latency sample per file)
+    texts, latencies = [], []
+    for file in files:
+        docs, elapsed = timed(lambda f: TextLoader(str(f), encoding="utf-8").load(), file)
+        texts.append(docs[0].page_content)
+        latencies.append(elapsed)
+    stats["load"] = summarize(latencies, len(files), sum(latencies))
+
+    # 2. Splitting (one sample per file)
+    chunks, latencies = [], []
+    for file_id, text in enumerate(texts):
+        file_chunks, elapsed = timed(split_file, text)
+        chunks.extend((file_id, offset, length, chunk) for offset, length, chunk in file_chunks)
+        latencies.append(elapsed)
+    stats["split"] = summarize(latencies, len(chunks), sum(latencies))
+
+    # 3. Embedding (one sample per request)
+    vectors, latencies = [], []
+    for i in range(0, len(chunks), EMBED_BATCH_SIZE):
+        batch = [chunk for _, _, _, chunk in chunks[i:i + EMBED_BATCH_SIZE]]
+        batch_vectors, elapsed = timed(embeddings.embed_documents, batch)
+        vectors.append(np.asarray(batch_vectors, dtype=np.float32))
+        latencies.append(elapsed)
+    stats["embed"] = summarize(latencies, len(chunks), sum(latencies))
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        # 4. Index add (one sample per batch). File text goes to the corpus blob outside the timing.
+        writer = CompactStoreWriter(out_dir)
+        for file, text in zip(files, texts):
+            writer.add_file(file.name, str(file), text)
+        latencies = []
+        for i, batch_vectors in enumerate(vectors):
+            batch = chunks[i * EMBED_BATCH_SIZE:(i + 1) * EMBED_BATCH_SIZE]
+            file_ids, offsets, lengths, _ = zip(*batch)
+            _, elapsed = timed(writer.add_chunks, file_ids, offsets, lengths, batch_vectors)
+            latencies.append(elapsed)
+        stats["index_add"] = summarize(latencies, len(chunks), sum(latencies))
+
+        # 5. Save (single sample): writes the FAISS index and chunk records, and builds the BM25
+        # index from every chunk's text, as create_index.py does
+        _, elapsed = timed(writer.save)
+        stats["save"] = summarize([elapsed], 1, elapsed)
+
+    return {"files": len(files), "chunks": len(chunks), "stages": stats, "peak_rss_mb": peak_rss_mb()}
+
+
+def _run_in_child(queue, files, embedder_kind, latency_ms):
+    queue.put(run_pipeline(files, embedder_kind, latency_ms))
+
+
+def benchmark_size(files, embedder_kind, latency_ms):
+    """Runs one corpus size in a fresh process so its peak RSS is not inflated by earlier runs."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_in_child, args=(queue, files, embedder_kind, latency_ms))
+    process.start()
     try:
-        # Create the index in-memory (we will not save it)
-        FAISS.from_documents(chunks, embeddings)
-    except Exception as e:
-        logging.error(f"An error occurred during sample index creation: {e}")
-        return
-
-    end_time = time.time()
-
-    # --- 4. Calculation & Estimation ---
-    time_for_sample = end_time - start_time
-    avg_time_per_file = time_for_sample / len(sample_files)
-    estimated_total_time_seconds = avg_time_per_file * total_files
-    
-    # Convert seconds to a more readable format (minutes and seconds)
-    est_minutes, est_seconds = divmod(estimated_total_time_seconds, 60)
-
-    logging.info("--- ⏱️ Time Estimation Complete ⏱️ ---")
-    logging.info(f"Time to process {len(sample_files)} files: {time_for_sample:.2f} seconds.")
-    logging.info(f"Average time per file: {avg_time_per_file:.2f} seconds.")
-    logging.info(f"Total files in directory: {total_files}.")
-    logging.info(f"ESTIMATED TOTAL TIME for all {total_files} files: {int(est_minutes)} minutes and {int(est_seconds)} seconds.")
-    logging.info("Note: This script did NOT save the index. Run 'create_index.py' to build the full index.")
+        while True:
+            try:
+                result = queue.get(timeout=CHILD_POLL_S)
+                break
+            except Empty:
+                if process.is_alive():
+                    continue
+                # The result may have reached the queue just before the process exited
+                try:
+                    result = queue.get(timeout=CHILD_POLL_S)
+                    break
+                except Empty:
+                    raise RuntimeError(
+                        f"Benchmark process for {len(files)} files exited with code {process.exitcode} without a result."
+                    ) from None
+    finally:
+        process.join(timeout=CHILD_POLL_S)
+    return result
+
+
+def print_report(results):
+    print("The save stage includes building the BM25 index from the chunk text.")
+    for result in results:
+        docs_per_s = result["files"] / sum(s["seconds"] for s in result["stages"].values())
+        print(
+            f"\n=== {result['files']} files, {result['chunks']} chunks | "
+            f"end-to-end {docs_per_s:.1f} docs/s | peak RSS {result['peak_rss_mb']:.0f} MB ==="
+        )
+        print(f"{'stage':<10} {'items':>7} {'total s':>9} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage in STAGES:
+            s = result["stages"][stage]
+            print(
+                f"{stage:<10} {s['items']:>7} {s['seconds']:>9.3f} {s['per_second']:>10.1f} "
+                f"{s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f}"
+            )
+
+
+def run_benchmarks(sizes=CORPUS_SIZES, embedder_kind="local", latency_ms=0.0):
+    """Benchmarks every indexing stage for each corpus size and returns the results."""
+    source_path = Path(SOURCE_DOCUMENTS_PATH)
+    all_files = sorted(source_path.glob("*.txt"))  # Sorted so every run uses the same files
+    if not all_files:
+        logging.error(f"No .txt files found in '{SOURCE_DOCUMENTS_PATH}'. Aborting.")
+        return []
+
+    results = []
+    for size in sizes:
+        files = all_files if size <= 0 else all_files[:size]
+        logging.info(f"Benchmarking {len(files)} files with the '{embedder_kind}' embedder...")
+        results.append(benchmark_size(files, embedder_kind, latency_ms))
+    return results
+
 
 if __name__ == "__main__":
-    estimate_indexing_time()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the indexing pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=CORPUS_SIZES, help="Corpus sizes in files (0 = all).")
+    parser.add_argument(
+        "--embedder", choices=["local", "provider"], default="local",
+        help="Embedding backend to measure: in-process fake, or the EMBEDDING_PROVIDER configured for llm_providers.",
+    )
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Simulated delay per local embedding request.")
+    parser.add_argument("--json", help="Also write the raw results to this file.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.embedder, args.embed_latency_ms)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,293 @@
+import os
+import json
+import asyncio
+import hashlib
+import inspect
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl  # Cross-process write lock (not available on Windows)
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Constants ---
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+INITIAL_CAPACITY = 4096  # Rows allocated when a cache file is first created
+EVICT_FRACTION = 0.1     # Share of rows freed at once when the cache is full
+KEY_BYTES = 32           # SHA-256 digest
+
+
+def text_key(kind: str, text: str) -> bytes:
+    """
+    Content address of a text. `kind` separates query and document embeddings,
+    which some models (e.g. Gemini's retrieval task types) embed differently.
+    """
+    return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of embedding vectors for one model.
+
+    Layout inside `<cache_dir>/<model>/`:
+      - vectors.f32  memory-mapped float32 matrix, one vector per row
+      - keys.bin     memory-mapped SHA-256 of the text stored in each row (all zeros = free)
+      - ticks.u64    memory-mapped last-access counter per row, used for LRU eviction
+      - meta.json    model name, dimension and current row capacity
+
+    The key of a row is written after its vector, so a row is only ever visible once it is
+    complete, and every hit is checked against the keys file. The in-memory offset index
+    (key -> row) is rebuilt from keys.bin on open.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.model_name = model_name
+        self.path = Path(cache_dir) / model_name.replace("/", "_")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dim = None
+        self.capacity = 0
+        self.offsets = {}
+        self.hits = 0
+        self.misses = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self._open(meta["capacity"])
+
+    # --- File Handling ---
+
+    def _row_bytes(self) -> int:
+        return self.dim * 4 + KEY_BYTES + 8
+
+    def _max_rows(self) -> int:
+        return max(1, self.max_bytes // self._row_bytes())
+
+    def _open(self, capacity: int):
+        """(Re)maps the cache files at the given capacity, growing them if needed."""
+        for name, row_size in (("vectors.f32", self.dim * 4), ("keys.bin", KEY_BYTES), ("ticks.u64", 8)):
+            file_path = self.path / name
+            with open(file_path, "ab") as f:
+                if f.tell() < capacity * row_size:
+                    f.truncate(capacity * row_size)
+        self.capacity = capacity
+        self.vectors = np.memmap(self.path / "vectors.f32", dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.keys = np.memmap(self.path / "keys.bin", dtype=np.uint8, mode="r+", shape=(capacity, KEY_BYTES))
+        self.ticks = np.memmap(self.path / "ticks.u64", dtype=np.uint64, mode="r+", shape=(capacity,))
+        self._tick = int(self.ticks.max()) if capacity else 0
+
+        with open(self.path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "capacity": capacity}, f)
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuilds the key -> row offset index from the keys file."""
+        used = np.flatnonzero(self.keys.any(axis=1))
+        self.offsets = {self.keys[row].tobytes(): int(row) for row in used}
+
+    def _file_lock(self):
+        return _FileLock(self.path / "lock")
+
+    # --- Lookups ---
+
+    def get_many(self, keys):
+        """Returns a list with the cached vector (as a list) or None for each key."""
+        results = []
+        with self._lock:
+            for key in keys:
+                row = self.offsets.get(key)
+                # Another process may have reused the row since our offset index was built
+                if row is not None and self.keys[row].tobytes() == key:
+                    self._tick += 1
+                    self.ticks[row] = self._tick
+                    results.append(self.vectors[row].tolist())
+                    self.hits += 1
+                else:
+                    results.append(None)
+                    self.misses += 1
+        return results
+
+    # --- Inserts & Eviction ---
+
+    def put_many(self, keys, vectors):
+        """Stores vectors under their keys, evicting least recently used rows when full."""
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._open(min(INITIAL_CAPACITY, self._max_rows()))
+            elif self.capacity < self._current_file_rows():
+                # Another process grew the files; remap so we see its rows
+                self._open(self._current_file_rows())
+            else:
+                self._reindex()
+
+            free_rows = []
+            for key, vector in zip(keys, vectors):
+                if key in self.offsets:
+                    continue
+                if not free_rows:
+                    free_rows = self._free_rows()
+                row = free_rows.pop()
+                self.keys[row] = 0  # Invalidate before overwriting the vector
+                self.vectors[row] = vector
+                self._tick += 1
+                self.ticks[row] = self._tick
+                self.keys[row] = np.frombuffer(key, dtype=np.uint8)
+                self.offsets[key] = row
+            self.vectors.flush()
+            self.keys.flush()
+
+    def _current_file_rows(self) -> int:
+        return os.path.getsize(self.path / "keys.bin") // KEY_BYTES
+
+    def _free_rows(self) -> list:
+        """Returns free rows (last one first), growing the files or evicting to make room."""
+        free = np.flatnonzero(~self.keys.any(axis=1))
+        if not len(free):
+            if self.capacity < self._max_rows():
+                self._open(min(self.capacity * 2, self._max_rows()))
+            else:
+                self._evict()
+            free = np.flatnonzero(~self.keys.any(axis=1))
+        return free[::-1].tolist()
+
+    def _evict(self):
+        """Frees the least recently used EVICT_FRACTION of rows."""
+        n = max(1, int(self.capacity * EVICT_FRACTION))
+        victims = np.argpartition(self.ticks, n - 1)[:n]
+        for row in victims:
+            self.offsets.pop(self.keys[row].tobytes(), None)
+        self.keys[victims] = 0
+        logger.info(f"Embedding cache for '{self.model_name}' full; evicted {n} entries.")
+
+    def stats(self) -> dict:
+        return {"entries": len(self.offsets), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+class _FileLock:
+    """Exclusive advisory lock on a file, so several processes can safely write the same cache."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embeddings model with an EmbeddingCache. Only texts that are not
+    already cached are sent to the model, and identical texts in one call are sent once.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def _lookup(self, kind, texts):
+        """Returns the cache keys, the cached vectors (None where missing) and the texts to embed by key."""
+        keys = [text_key(kind, text) for text in texts]
+        results = self.cache.get_many(keys)
+        missing = {}
+        for key, text, vector in zip(keys, texts, results):
+            if vector is None and key not in missing:
+                missing[key] = text
+        return keys, results, missing
+
+    def _merge(self, keys, results, missing, new_vectors):
+        """Caches freshly embedded vectors and fills them into the lookup results."""
+        # Round through float32 so fresh results match what later cache hits return
+        new_vectors = np.asarray(new_vectors, dtype=np.float32)
+        self.cache.put_many(list(missing.keys()), new_vectors)
+        by_key = dict(zip(missing.keys(), new_vectors.tolist()))
+        return [vector if vector is not None else by_key[key] for key, vector in zip(keys, results)]
+
+    def _embed(self, kind, texts, embed_fn):
+        keys, results, missing = self._lookup(kind, texts)
+        if missing:
+            results = self._merge(keys, results, missing, embed_fn(list(missing.values())))
+        return results
+
+    async def _aembed(self, kind, texts, aembed_fn):
+        # The cache takes a file lock and flushes its memory maps; keep that off the event loop
+        keys, results, missing = await asyncio.to_thread(self._lookup, kind, texts)
+        if missing:
+            new_vectors = await aembed_fn(list(missing.values()))
+            results = await asyncio.to_thread(self._merge, keys, results, missing, new_vectors)
+        return results
+
+    def embed_documents(self, texts):
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts):
+        """Embeds several queries, sending all cache misses to the model in one request where it can."""
+        return self._embed("query", texts, self._embed_queries_uncached)
+
+    def _embed_queries_uncached(self, texts):
+        # Gemini embeds queries and documents differently; its batch call takes the task type
+        if "task_type" in inspect.signature(self.embeddings.embed_documents).parameters:
+            return self.embeddings.embed_documents(texts, task_type="retrieval_query")
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    async def aembed_documents(self, texts):
+        return await self._aembed("document", texts, self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text):
+        async def embed_one(texts):
+            return [await self.embeddings.aembed_query(texts[0])]
+        return (await self._aembed("query", [text], embed_one))[0]
+
+    async def aembed_queries(self, texts):
+        """Async counterpart of embed_queries."""
+        return await self._aembed("query", texts, self._aembed_queries_uncached)
+
+    async def _aembed_queries_uncached(self, texts):
+        if "task_type" in inspect.signature(self.embeddings.aembed_documents).parameters:
+            return await self.embeddings.aembed_documents(texts, task_type="retrieval_query")
+        return list(await asyncio.gather(*(self.embeddings.aembed_query(text) for text in texts)))
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR) -> EmbeddingCache:
+    """Returns the process-wide cache for a model, so every call site shares one instance."""
+    with _caches_lock:
+        key = (cache_dir, model_name)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model_name, cache_dir)
+        return _caches[key]
+
+
+def with_cache(embeddings: Embeddings, model_name: str) -> CachedEmbeddings:
+    """Wraps an embeddings model with the shared on-disk cache for `model_name`."""
+    return CachedEmbeddings(embeddings, get_embedding_cache(model_name))
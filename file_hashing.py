@@ -0,0 +1,10 @@
+import hashlib
+
+
+def file_sha256(path):
+    """Hashes a file's contents so that edits can be detected between runs."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,468 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import functools
+import weakref
+import concurrent.futures
+from collections import Counter
+from typing import Any, Optional
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from embedding_cache import with_cache
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- Provider Settings ---
+# "gemini" goes through Google's SDK. "openai" and "ollama" speak those HTTP APIs to any
+# compatible server: OpenAI, vLLM, llama.cpp, Ollama, or mock_llm_server.py for offline runs.
+PROVIDERS = ("gemini", "openai", "ollama")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # Clause generation
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+SUMMARY_PROVIDER = os.getenv("SUMMARY_PROVIDER", "ollama")  # PDF summaries
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "mistral")
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini")  # Changing it means re-running create_index.py
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# --- Transport Settings (openai and ollama providers) ---
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # Seconds per attempt; also passed to the Gemini SDK
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # Further attempts after a retryable failure
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # Seconds; doubles with every attempt
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))  # Seconds before a slow request is duplicated; 0 disables
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))  # Connections kept open per server
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+# Runs the attempts of hedged synchronous requests
+_hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2 * LLM_POOL_SIZE, thread_name_prefix="llm-hedge")
+
+
+class HTTPTransport:
+    """
+    Pooled HTTP client for one LLM server, shared by every model that talks to it. Each
+    attempt is bounded by a timeout; connection errors, timeouts and retryable statuses are
+    retried up to `max_retries` times with full-jitter exponential backoff (or the server's
+    Retry-After). With `hedge_after`, a request still unanswered after that many seconds is
+    sent a second time and whichever attempt answers first wins. Thread-safe; async calls
+    get one connection pool per event loop.
+    """
+
+    def __init__(self, base_url, headers=None, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 hedge_after=LLM_HEDGE_AFTER, pool_size=LLM_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()  # Connections cannot move between event loops
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(base_url=self.base_url, headers=self.headers, limits=self.limits)
+            return self._client
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(base_url=self.base_url, headers=self.headers, limits=self.limits)
+                self._async_clients[loop] = client
+            return client
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _timeout(self, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        return httpx.Timeout(timeout, connect=min(timeout, LLM_CONNECT_TIMEOUT))
+
+    @staticmethod
+    def _status_error(response):
+        return httpx.HTTPStatusError(
+            f"Server error '{response.status_code}' for url '{response.request.url}'",
+            request=response.request, response=response,
+        )
+
+    def _backoff(self, attempt, error):
+        """Full-jitter exponential backoff, or the server's Retry-After when it sends one."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+        return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _should_retry(self, path, attempt, error):
+        """Logs a failed attempt and returns the delay before the next one, or None to give up."""
+        if attempt >= self.max_retries:
+            self._count("failures")
+            return None
+        self._count("retries")
+        delay = self._backoff(attempt, error)
+        logger.warning(f"⚠️ {self.base_url}{path} failed ({error!r}); retrying in {delay:.2f}s...")
+        return delay
+
+    # --- Requests ---
+
+    def _send(self, path, payload, timeout):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.post(path, json=payload, timeout=timeout)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = self._status_error(response)
+            except httpx.TransportError as e:
+                error = e
+            delay = self._should_retry(path, attempt, error)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+
+    async def _asend(self, path, payload, timeout):
+        client = self.async_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.post(path, json=payload, timeout=timeout)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = self._status_error(response)
+            except httpx.TransportError as e:
+                error = e
+            delay = self._should_retry(path, attempt, error)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+
+    def post(self, path, payload, timeout=None):
+        """POSTs JSON and returns the decoded reply. `timeout` overrides the per-attempt default."""
+        self._count("requests")
+        timeout = self._timeout(timeout)
+        if not self.hedge_after:
+            return self._send(path, payload, timeout)
+        # The losing attempt cannot be interrupted from here; its reply is simply ignored
+        futures = [_hedge_pool.submit(self._send, path, payload, timeout)]
+        done, _ = concurrent.futures.wait(futures, timeout=self.hedge_after)
+        if not done:
+            self._count("hedged")
+            futures.append(_hedge_pool.submit(self._send, path, payload, timeout))
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is None:
+                if future is not futures[0]:
+                    self._count("hedge_wins")
+                return future.result()
+        return futures[0].result()
+
+    async def apost(self, path, payload, timeout=None):
+        """Async counterpart of post; the losing attempt of a hedged request is cancelled."""
+        self._count("requests")
+        timeout = self._timeout(timeout)
+        if not self.hedge_after:
+            return await self._asend(path, payload, timeout)
+        tasks = [asyncio.ensure_future(self._asend(path, payload, timeout))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                self._count("hedged")
+                tasks.append(asyncio.ensure_future(self._asend(path, payload, timeout)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self._count("hedge_wins")
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def astream_lines(self, path, payload, timeout=None):
+        """
+        POSTs JSON and yields the non-empty lines of the reply as they arrive. Failures are
+        retried only until the first line has been yielded, and streams are never hedged.
+        """
+        self._count("requests")
+        client = self.async_client()
+        timeout = self._timeout(timeout)
+        started = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with client.stream("POST", path, json=payload, timeout=timeout) as response:
+                    if response.status_code not in RETRYABLE_STATUS:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if line:
+                                started = True
+                                yield line
+                        return
+                    error = self._status_error(response)
+            except httpx.TransportError as e:
+                if started:
+                    raise
+                error = e
+            delay = self._should_retry(path, attempt, error)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.counters["requests"],
+                "retries": self.counters["retries"],
+                "failures": self.counters["failures"],
+                "hedged": self.counters["hedged"],
+                "hedge_wins": self.counters["hedge_wins"],
+            }
+
+
+# --- Wire Formats ---
+
+class OpenAIDialect:
+    chat_path = "/chat/completions"
+    embed_path = "/embeddings"
+
+    @staticmethod
+    def chat_payload(model, messages, temperature, stop, stream):
+        payload = {"model": model, "messages": messages, "stream": stream}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if stop:
+            payload["stop"] = stop
+        return payload
+
+    @staticmethod
+    def chat_text(reply):
+        return reply["choices"][0]["message"]["content"] or ""
+
+    @staticmethod
+    def stream_text(line):
+        """Text carried by one server-sent event line; None once the stream is done."""
+        if not line.startswith("data:"):
+            return ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+        choices = json.loads(data).get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content") or ""
+
+    @staticmethod
+    def embed_payload(model, texts):
+        return {"model": model, "input": texts}
+
+    @staticmethod
+    def embeddings(reply):
+        return [item["embedding"] for item in sorted(reply["data"], key=lambda item: item["index"])]
+
+
+class OllamaDialect:
+    chat_path = "/api/chat"
+    embed_path = "/api/embed"
+
+    @staticmethod
+    def chat_payload(model, messages, temperature, stop, stream):
+        options = {}
+        if temperature is not None:
+            options["temperature"] = temperature
+        if stop:
+            options["stop"] = stop
+        return {"model": model, "messages": messages, "stream": stream, "options": options}
+
+    @staticmethod
+    def chat_text(reply):
+        return reply["message"]["content"]
+
+    @staticmethod
+    def stream_text(line):
+        """Text carried by one NDJSON line; None once the stream is done."""
+        message = json.loads(line)
+        text = message.get("message", {}).get("content") or ""
+        return None if message.get("done") and not text else text
+
+    @staticmethod
+    def embed_payload(model, texts):
+        return {"model": model, "input": texts}
+
+    @staticmethod
+    def embeddings(reply):
+        return reply["embeddings"]
+
+
+DIALECTS = {"openai": OpenAIDialect, "ollama": OllamaDialect}
+
+
+# --- LangChain Models ---
+
+class HTTPChatModel(BaseChatModel):
+    """
+    LangChain chat model for an OpenAI- or Ollama-compatible server. A per-call timeout can
+    be passed through LangChain, e.g. `llm.invoke(messages, timeout=10)`.
+    """
+
+    transport: Any
+    provider: str
+    model: str
+    temperature: Optional[float] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"{self.provider}-http"
+
+    @property
+    def _dialect(self):
+        return DIALECTS[self.provider]
+
+    def _payload(self, messages, stop, stream):
+        messages = [{"role": ROLES.get(message.type, "user"), "content": message.content} for message in messages]
+        return self._dialect.chat_payload(self.model, messages, self.temperature, stop, stream)
+
+    def _result(self, reply):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._dialect.chat_text(reply)))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self.transport.post(self._dialect.chat_path, self._payload(messages, stop, False), kwargs.get("timeout"))
+        return self._result(reply)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = await self.transport.apost(self._dialect.chat_path, self._payload(messages, stop, False), kwargs.get("timeout"))
+        return self._result(reply)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        lines = self.transport.astream_lines(self._dialect.chat_path, self._payload(messages, stop, True), kwargs.get("timeout"))
+        async for line in lines:
+            text = self._dialect.stream_text(line)
+            if text is None:
+                break
+            if text:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if run_manager:
+                    await run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+
+
+class HTTPEmbeddings(Embeddings):
+    """LangChain embeddings for an OpenAI- or Ollama-compatible server."""
+
+    def __init__(self, transport, provider, model):
+        self.transport = transport
+        self.dialect = DIALECTS[provider]
+        self.model = model
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        reply = self.transport.post(self.dialect.embed_path, self.dialect.embed_payload(self.model, list(texts)))
+        return self.dialect.embeddings(reply)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        if not texts:
+            return []
+        reply = await self.transport.apost(self.dialect.embed_path, self.dialect.embed_payload(self.model, list(texts)))
+        return self.dialect.embeddings(reply)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+# --- Factories ---
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(base_url, api_key=None) -> HTTPTransport:
+    """Returns the process-wide transport for a server, so all its models share one connection pool."""
+    if "://" not in base_url:
+        base_url = f"http://{base_url}"  # OLLAMA_HOST is often given as host:port
+    with _transports_lock:
+        if base_url not in _transports:
+            headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+            _transports[base_url] = HTTPTransport(base_url, headers)
+        return _transports[base_url]
+
+
+def _check_provider(provider):
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown provider '{provider}'. Choose from {PROVIDERS}.")
+    if provider == "gemini" and not os.getenv("GEMINI_API_KEY"):
+        raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it.")
+
+
+def _provider_transport(provider):
+    if provider == "openai":
+        return get_transport(OPENAI_BASE_URL, os.getenv("OPENAI_API_KEY"))
+    return get_transport(OLLAMA_BASE_URL)
+
+
+def chat_model(provider=LLM_PROVIDER, model=LLM_MODEL, temperature=None):
+    """Builds a LangChain chat model; by default the one configured for clause generation."""
+    _check_provider(provider)
+    if provider == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        extra = {} if temperature is None else {"temperature": temperature}
+        return ChatGoogleGenerativeAI(
+            model=model, google_api_key=os.getenv("GEMINI_API_KEY"), timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, **extra
+        )
+    return HTTPChatModel(transport=_provider_transport(provider), provider=provider, model=model, temperature=temperature)
+
+
+@functools.lru_cache(maxsize=1)
+def summary_model():
+    """The chat model configured for PDF summaries, built once per process."""
+    return chat_model(SUMMARY_PROVIDER, SUMMARY_MODEL)
+
+
+def embedding_model(provider=EMBEDDING_PROVIDER, model=EMBEDDING_MODEL):
+    """Builds an (uncached) LangChain embeddings model; by default the one the index is built with."""
+    _check_provider(provider)
+    if provider == "gemini":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=model, google_api_key=os.getenv("GEMINI_API_KEY"))
+    return HTTPEmbeddings(_provider_transport(provider), provider, model)
+
+
+def embedding_model_name(provider=EMBEDDING_PROVIDER, model=EMBEDDING_MODEL):
+    """Name the embedding cache and the index manifest record vectors under."""
+    return model if provider == "gemini" else f"{provider}/{model}"
+
+
+def cached_embedding_model(provider=EMBEDDING_PROVIDER, model=EMBEDDING_MODEL):
+    """The embeddings model behind the shared on-disk embedding cache."""
+    return with_cache(embedding_model(provider, model), embedding_model_name(provider, model))
+
+
+def stats() -> dict:
+    """Request, retry and hedging counters per server."""
+    with _transports_lock:
+        return {base_url: transport.stats() for base_url, transport in _transports.items()}
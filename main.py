@@ -15,10 +15,10 @@ except RuntimeError:
 
 # --- LangChain Imports ---
 try:
-    from langchain_community.vectorstores import FAISS
     from langchain.chains import RetrievalQA
     from langchain.prompts import PromptTemplate
-    from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+    from compact_store import CompactVectorStore
+    import llm_providers
 except ImportError as e:
     st.error(f"A required library is not installed. Please check your requirements.txt. Error: {e}", icon="🚨")
     st.stop()
@@ -31,19 +31,18 @@ load_dotenv()
 # --- Core RAG Functions ---
 
 def init_llm():
-    """Initializes the LLM and embeddings models."""
-    logger.info("Initializing Gemini LLM and Embeddings...")
-    gemini_api_key = os.getenv('GEMINI_API_KEY')
-    if not gemini_api_key:
+    """Initializes the LLM and embeddings models (see llm_providers for the configuration)."""
+    logger.info(f"Initializing LLM ({llm_providers.LLM_PROVIDER}) and Embeddings ({llm_providers.EMBEDDING_PROVIDER})...")
+    if "gemini" in (llm_providers.LLM_PROVIDER, llm_providers.EMBEDDING_PROVIDER) and not os.getenv('GEMINI_API_KEY'):
         st.error("Your Gemini API key is missing. Please add it to your .env file.", icon="🔑")
         st.stop()
     
     try:
-        llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=gemini_api_key, temperature=0.8)
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=gemini_api_key)
+        llm = llm_providers.chat_model(temperature=0.8)
+        embeddings = llm_providers.cached_embedding_model()
         return llm, embeddings
     except Exception as e:
-        st.error(f"Error initializing the Gemini model: {e}", icon="🔥")
+        st.error(f"Error initializing the models: {e}", icon="🔥")
         st.stop()
 
 @st.cache_resource(show_spinner="Loading knowledge base...")
@@ -54,7 +53,7 @@ def load_vector_store(_embeddings):
     INDEX_PATH = "faiss_index"
     logger.info(f"Checking for pre-built index at '{INDEX_PATH}'...")
 
-    if not os.path.exists(INDEX_PATH):
+    if not CompactVectorStore.exists(INDEX_PATH):
         logger.error("FAISS index not found!")
         st.error(
             f"The '{INDEX_PATH}' folder was not found. Please run the `create_index.py` script first to build your knowledge base.",
@@ -63,7 +62,7 @@ def load_vector_store(_embeddings):
         st.stop()
     
     try:
-        vector_store = FAISS.load_local(INDEX_PATH, _embeddings, allow_dangerous_deserialization=True)
+        vector_store = CompactVectorStore.load(INDEX_PATH, _embeddings)
         logger.info("Successfully loaded knowledge base from disk.")
         return vector_store
     except Exception as e:
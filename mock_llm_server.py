@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+from collections import Counter
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Local stand-in for an OpenAI- or Ollama-compatible LLM server with configurable latency and
+# failures, so the whole stack can be tuned and load-tested offline. Point the app at it with
+#   LLM_PROVIDER=ollama SUMMARY_PROVIDER=ollama EMBEDDING_PROVIDER=ollama OLLAMA_HOST=http://localhost:11434
+# (or the openai providers with OPENAI_BASE_URL=http://localhost:11434/v1).
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Mock Settings (overridable on the command line) ---
+settings = {
+    "latency_ms": float(os.getenv("MOCK_LATENCY_MS", "200")),  # Before the first token / the embedding reply
+    "jitter_ms": float(os.getenv("MOCK_JITTER_MS", "50")),  # Uniform random extra latency
+    "token_delay_ms": float(os.getenv("MOCK_TOKEN_DELAY_MS", "10")),  # Per generated token
+    "slow_rate": float(os.getenv("MOCK_SLOW_RATE", "0")),  # Share of requests that also take slow_ms (a latency tail)
+    "slow_ms": float(os.getenv("MOCK_SLOW_MS", "2000")),
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),  # Share of requests answered with a 503
+    "embedding_dim": int(os.getenv("MOCK_EMBEDDING_DIM", "768")),
+}
+
+REPLY = (
+    "Either Party may terminate this Agreement for convenience upon thirty (30) days' prior written notice "
+    "to the other Party. The Receiving Party shall hold all Confidential Information in strict confidence "
+    "and shall indemnify the Disclosing Party against any losses arising from a breach of this Section."
+)
+
+app = FastAPI(title="Mock LLM Server")
+counters = Counter()
+
+
+async def simulate_latency():
+    """Sleeps for the configured latency; returns a 503 response instead for injected failures."""
+    delay = settings["latency_ms"] + random.uniform(0, settings["jitter_ms"])
+    if random.random() < settings["slow_rate"]:
+        delay += settings["slow_ms"]
+    await asyncio.sleep(delay / 1000)
+    if random.random() < settings["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse(status_code=503, content={"error": "Injected failure from the mock server."})
+    return None
+
+
+def reply_tokens(messages):
+    """The canned reply, followed by the start of the last message so replies differ by prompt."""
+    prompt = messages[-1]["content"] if messages else ""
+    text = f"{REPLY} [Prompt: {' '.join(prompt.split()[:12])}]"
+    return [word + " " for word in text.split()]
+
+
+def embed(text):
+    """Deterministic unit vector for a text, so equal texts always embed alike."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).normal(size=settings["embedding_dim"])
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+async def token_stream(tokens, format_token, done=None):
+    for token in tokens:
+        await asyncio.sleep(settings["token_delay_ms"] / 1000)
+        yield format_token(token)
+    if done:
+        yield done
+
+
+# --- OpenAI-Compatible API ---
+
+@app.get("/v1/models")
+async def openai_models():
+    return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body = await request.json()
+    counters["chat"] += 1
+    error = await simulate_latency()
+    if error:
+        return error
+    tokens = reply_tokens(body.get("messages", []))
+    model, created = body.get("model", "mock"), int(time.time())
+
+    if body.get("stream"):
+        def chunk(token):
+            data = {"object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            return f"data: {json.dumps(data)}\n\n"
+        return StreamingResponse(token_stream(tokens, chunk, "data: [DONE]\n\n"), media_type="text/event-stream")
+
+    await asyncio.sleep(len(tokens) * settings["token_delay_ms"] / 1000)
+    return {
+        "object": "chat.completion", "created": created, "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+        "usage": {"completion_tokens": len(tokens)},
+    }
+
+
+@app.post("/v1/embeddings")
+async def openai_embeddings(request: Request):
+    body = await request.json()
+    counters["embed"] += 1
+    error = await simulate_latency()
+    if error:
+        return error
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    data = [{"object": "embedding", "index": i, "embedding": embed(text)} for i, text in enumerate(texts)]
+    return {"object": "list", "model": body.get("model", "mock"), "data": data}
+
+
+# --- Ollama-Compatible API ---
+
+@app.get("/api/tags")
+async def ollama_tags():
+    return {"models": [{"name": "mock", "model": "mock"}]}
+
+
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    body = await request.json()
+    counters["chat"] += 1
+    error = await simulate_latency()
+    if error:
+        return error
+    tokens = reply_tokens(body.get("messages", []))
+    model = body.get("model", "mock")
+
+    if body.get("stream", True):  # Ollama streams unless told not to
+        def chunk(token):
+            return json.dumps({"model": model, "message": {"role": "assistant", "content": token}, "done": False}) + "\n"
+        done = json.dumps({"model": model, "message": {"role": "assistant", "content": ""}, "done": True}) + "\n"
+        return StreamingResponse(token_stream(tokens, chunk, done), media_type="application/x-ndjson")
+
+    await asyncio.sleep(len(tokens) * settings["token_delay_ms"] / 1000)
+    return {"model": model, "message": {"role": "assistant", "content": "".join(tokens)}, "done": True}
+
+
+@app.post("/api/embed")
+async def ollama_embed(request: Request):
+    body = await request.json()
+    counters["embed"] += 1
+    error = await simulate_latency()
+    if error:
+        return error
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    return {"model": body.get("model", "mock"), "embeddings": [embed(text) for text in texts]}
+
+
+# Request and injected-error counts, for checking what a load test actually sent
+@app.get("/stats")
+async def stats():
+    return {"counters": dict(counters), "settings": settings}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI/Ollama-compatible API with configurable latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434, help="11434 is Ollama's default port.")
+    for name, value in settings.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    settings.update({name: getattr(args, name) for name in settings})
+    logging.info(f"Mock LLM server settings: {settings}")
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -1,7 +1,15 @@
+import functools
+
 import fitz  # PyMuPDF
 from sentence_transformers import SentenceTransformer
 import numpy as np
-import faiss
+from langchain_core.embeddings import Embeddings
+
+import ann_index
+import chunker
+from embedding_cache import with_cache
+
+SENTENCE_MODEL = 'all-MiniLM-L6-v2'
 
 def extract_text_from_pdf(pdf_path):
     """Extracts text from a PDF file."""
@@ -16,28 +24,49 @@ def extract_text_from_pdf(pdf_path):
         print(f"Error extracting text from {pdf_path}: {e}")
     return text
 
-def chunk_text(text, chunk_size=500, overlap=50):
-    """Chunks text into smaller pieces with a specified overlap."""
-    chunks = []
+def chunk_text(text, chunk_size=chunker.CHUNK_SIZE, overlap=chunker.CHUNK_OVERLAP):
+    """
+    Chunks text into pieces of at most `chunk_size` characters with the section-aware chunker.
+    Sizes are in characters, like the rest of the pipeline (they used to be in words).
+    """
     if not text:
-        return chunks
-    words = text.split()
-    i = 0
-    while i < len(words):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
-        i += chunk_size - overlap
-    return chunks
+        return []
+    return chunker.split_text(text, chunk_size, overlap)
+
+@functools.lru_cache(maxsize=None)
+def sentence_model(model_name=SENTENCE_MODEL):
+    """The SentenceTransformer model, loaded once per process on first use."""
+    return SentenceTransformer(model_name)
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """LangChain embeddings for a local SentenceTransformer model."""
+
+    def __init__(self, model_name=SENTENCE_MODEL):
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return sentence_model(self.model_name).encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+@functools.lru_cache(maxsize=None)
+def cached_embeddings(model_name=SENTENCE_MODEL):
+    """The SentenceTransformer embeddings behind the shared on-disk embedding cache."""
+    return with_cache(SentenceTransformerEmbeddings(model_name), model_name)
 
 def create_embeddings(chunks):
-    """Creates embeddings for a list of text chunks using SentenceTransformer."""
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = model.encode(chunks)
-    return np.array(embeddings).astype('float32')
-
-def create_faiss_index(embeddings):
-    """Creates a FAISS index from embeddings."""
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
-    return index
+    """
+    Creates embeddings for a list of text chunks using SentenceTransformer.
+    Chunks already in the shared embedding cache are not re-encoded.
+    """
+    return np.array(cached_embeddings().embed_documents(chunks)).astype('float32')
+
+def create_faiss_index(embeddings, index_type="flat", **params):
+    """
+    Creates a FAISS index from embeddings.
+    `index_type` and `params` are passed to ann_index.build_index (flat, ivf_flat, ivf_pq or hnsw).
+    """
+    return ann_index.build_index(embeddings, index_type, **params)
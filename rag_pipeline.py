@@ -1,47 +1,323 @@
 import os
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+import numpy as np
 
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 load_dotenv()
 from langchain_core.messages import HumanMessage
 
+from bm25_index import reciprocal_rank_fusion
+from clause_classifier import CentroidClassifier
+from compact_store import CompactVectorStore
+from concurrency import ConcurrencyLimiter
+from context_packing import pack_context
+from semantic_cache import SemanticCache
+from contract_metadata import filter_key
+import llm_providers
+from ttl_cache import TTLCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Memory-map the saved index so every worker process shares one copy of it in the page cache
+# (see bench_memory.py); "0" reads it into each process instead
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") != "0"
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))  # Seconds
+# "vector": embeddings only. "hybrid": fuse BM25 and vector rankings. "auto": hybrid, but skip
+# the embedding call when the keyword results are decisive (see RAGPipeline.is_decisive).
+RETRIEVAL_MODES = ("vector", "hybrid", "auto")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "auto")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # Taken from each ranking before fusing
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # Outstanding async LLM calls
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))  # Further calls allowed to wait before rejecting
+LLM_RETRY_AFTER = int(os.getenv("LLM_RETRY_AFTER", "5"))  # Seconds suggested to rejected clients
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # Estimated tokens of retrieved examples per prompt
+# Semantic response cache: paraphrased prompts grounded in the same chunks reuse a generated answer
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))  # 0 disables the cache
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # Seconds
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.93"))  # Minimum cosine similarity
+RESPONSE_CACHE_MIN_OVERLAP = float(os.getenv("RESPONSE_CACHE_MIN_OVERLAP", "0.6"))  # Shared share of retrieved chunks
+
 class RAGPipeline:
-    def __init__(self, faiss_index_path="../faiss_index"):
+    def __init__(self, faiss_index_path="../faiss_index", cache_size=QUERY_CACHE_SIZE, cache_ttl=QUERY_CACHE_TTL,
+                 retrieval_mode=RETRIEVAL_MODE, context_token_budget=CONTEXT_TOKEN_BUDGET):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}'. Choose from {RETRIEVAL_MODES}.")
         self.faiss_index_path = faiss_index_path
+        self.retrieval_mode = retrieval_mode
+        self.context_token_budget = context_token_budget
         self.index = None
         self.embeddings_model = None # Initialize embeddings model once
         self.llm = None
+        self.classifier = None  # Embedding clause classifier, if its centroids were computed for this index
+        self.retrieval_paths = Counter()  # How many queries were answered by each retrieval path
+        self._paths_lock = threading.Lock()  # Retrieval also runs in worker threads
+        self.llm_limiter = ConcurrencyLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_RETRY_AFTER)
+        self.response_cache = SemanticCache(
+            RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_MIN_OVERLAP
+        )
+        # Responses to lexical fast-path queries, which have no vector, by normalized query and chunks
+        self.exact_response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+        # Retried and lightly edited prompts skip the embedding round-trip and the search
+        self.query_embedding_cache = TTLCache(cache_size, cache_ttl)
+        self.retrieval_cache = TTLCache(cache_size, cache_ttl)
         self._initialize_pipeline()
 
     def _initialize_pipeline(self):
         """Initializes the RAG pipeline by loading the pre-built FAISS index."""
-        # Initialize Google Generative AI Embeddings model for query embedding
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it.")
-        self.embeddings_model = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
-        self.llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key)
+        # Embeddings for queries (must match the index) and the LLM for generation, as configured
+        # in llm_providers (Gemini unless overridden)
+        self.embeddings_model = llm_providers.cached_embedding_model()
+        self.llm = llm_providers.chat_model()
 
         # Load the pre-built FAISS index
-        if not os.path.exists(self.faiss_index_path):
+        if not CompactVectorStore.exists(self.faiss_index_path):
             raise FileNotFoundError(f"FAISS index not found at {self.faiss_index_path}. Please run create_index.py first.")
-        
-        # When loading, we need to provide the embeddings model that was used to create the index
-        self.index = FAISS.load_local(self.faiss_index_path, self.embeddings_model, allow_dangerous_deserialization=True)
 
-    def retrieve(self, query, k=5):
-        """Retrieves the top k most relevant chunks for a given query using the loaded FAISS index."""
-        # Use the loaded FAISS index's similarity search
-        docs = self.index.similarity_search(query, k=k)
-        return docs
+        # Vectors and chunk text are memory-mapped, so loading is fast, nothing is unpickled and
+        # uvicorn workers on one machine share the same physical pages.
+        # We still need the embeddings model that was used to create the index to embed queries.
+        self.index = CompactVectorStore.load(self.faiss_index_path, self.embeddings_model, mmap=INDEX_MMAP)
+        self.classifier = self._load_classifier()
 
-    def generate(self, query, retrieved_chunks):
-        """Generates a new clause using the user's query and retrieved chunks."""
-        prompt = f"**User Intent:** {query}"
+    def _load_classifier(self):
+        """The index's clause centroids, unless they are missing or from another embedding model."""
+        if not CentroidClassifier.exists(self.faiss_index_path):
+            logger.info("Clause centroids not found; run clause_classifier.py to enable embedding-based classification.")
+            return None
+        classifier = CentroidClassifier.load(self.faiss_index_path)
+        if classifier.embedding != llm_providers.embedding_model_name():
+            logger.warning(f"Clause centroids were computed with '{classifier.embedding}', not the configured embedding model; ignoring them.")
+            return None
+        if classifier.index_version != self.index.version:
+            logger.warning("Clause centroids predate the current index; run clause_classifier.py to refresh them.")
+        # Classification reads the stored vectors of retrieved chunks
+        self.index.enable_chunk_vectors()
+        return classifier
+
+    def embed_query(self, query):
+        """
+        Embeds a query, reusing the vector of an identical (normalized) recent query. The
+        normalized form is only the cache key; the model sees the query as it was written.
+        """
+        return self.embed_queries([query])[0]
+
+    def _queries_to_embed(self, queries):
+        """Cached vectors by normalized key, and the original text to embed for each key not cached."""
+        vectors, to_embed = {}, {}
+        for query in queries:
+            key = normalize_query(query)
+            if key not in vectors:
+                vectors[key] = self.query_embedding_cache.get(key)
+                if vectors[key] is None:
+                    to_embed[key] = query  # The first spelling seen for a key is the one embedded
+        return vectors, to_embed
+
+    def _cache_embedded(self, vectors, to_embed, embedded, queries):
+        for key, vector in zip(to_embed, embedded):
+            self.query_embedding_cache.put(key, vector)
+            vectors[key] = vector
+        return [vectors[normalize_query(query)] for query in queries]
+
+    def embed_queries(self, queries):
+        """
+        Embeds queries, one vector per query. Queries equal after normalization share a vector,
+        and every one not in the query cache is sent in a single request.
+        """
+        vectors, to_embed = self._queries_to_embed(queries)
+        texts = list(to_embed.values())
+        if len(texts) == 1:
+            embedded = [self.embeddings_model.embed_query(texts[0])]
+        else:
+            embedded = self.embeddings_model.embed_queries(texts) if texts else []
+        return self._cache_embedded(vectors, to_embed, embedded, queries)
+
+    async def aembed_queries(self, queries):
+        """Async counterpart of embed_queries."""
+        vectors, to_embed = self._queries_to_embed(queries)
+        texts = list(to_embed.values())
+        if len(texts) == 1:
+            embedded = [await self.embeddings_model.aembed_query(texts[0])]
+        else:
+            embedded = await self.embeddings_model.aembed_queries(texts) if texts else []
+        return self._cache_embedded(vectors, to_embed, embedded, queries)
+
+    @staticmethod
+    def is_decisive(hits, k):
+        """
+        Keyword results are trusted on their own when there are at least k of them and each
+        contains every indexed term of the query, as with exact terms of art such as
+        "liquidated damages" or "termination for convenience".
+        """
+        return len(hits) >= k and all(coverage == 1.0 for _, _, coverage in hits[:k])
+
+    def _lexical_hits(self, keys, k, mode, filter):
+        """BM25 hits per query, or an empty dict when the mode or the index has no keyword search."""
+        if mode == "vector" or self.index.lexical is None:
+            return {}
+        return {key: self.index.keyword_search(key, k=max(k, HYBRID_CANDIDATES), filter=filter) for key in keys}
+
+    def _needs_vectors(self, keys, k, mode, lexical):
+        # The lexical fast path: decisive keyword results need no embedding call at all
+        return [key for key in keys if not (mode == "auto" and self.is_decisive(lexical.get(key, []), k))]
+
+    def _fuse(self, keys, k, lexical, vector_rows):
+        """Combines keyword and vector rankings into one list of chunk rows per query."""
+        results, paths = [], Counter()
+        for key in keys:
+            if key not in vector_rows:
+                path, rows = "lexical", [row for row, _, _ in lexical[key][:k]]
+            elif key in lexical:
+                path, rows = "hybrid", reciprocal_rank_fusion([vector_rows[key], [row for row, _, _ in lexical[key]]])[:k]
+            else:
+                path, rows = "vector", vector_rows[key][:k]
+            paths[path] += 1
+            results.append(rows)
+        with self._paths_lock:
+            self.retrieval_paths.update(paths)
+        return results
+
+    def _retrieve_rows(self, queries, k, mode, filter=None):
+        """
+        Ranks chunk rows for distinct queries, given as {normalized query: original text};
+        returns one list of rows per query. Keyword search uses the normalized form, the
+        embedding model the original text.
+        """
+        keys = list(queries)
+        lexical = self._lexical_hits(keys, k, mode, filter)
+        needs_vectors = self._needs_vectors(keys, k, mode, lexical)
+        vector_rows = {}
+        if needs_vectors:
+            depth = max(k, HYBRID_CANDIDATES) if lexical else k
+            vectors = self.embed_queries([queries[key] for key in needs_vectors])
+            vector_rows = dict(zip(needs_vectors, self.index.search_rows(vectors, k=depth, filter=filter)))
+        return self._fuse(keys, k, lexical, vector_rows)
 
-        for i, doc in enumerate(retrieved_chunks):
-            prompt += f"{i+1}. {doc.page_content}\n"
+    async def _aretrieve_rows(self, queries, k, mode, filter=None):
+        """Async counterpart of _retrieve_rows: the embedding call is awaited, BM25 and FAISS run off the event loop."""
+        keys = list(queries)
+        lexical = await asyncio.to_thread(self._lexical_hits, keys, k, mode, filter)
+        needs_vectors = self._needs_vectors(keys, k, mode, lexical)
+        vector_rows = {}
+        if needs_vectors:
+            depth = max(k, HYBRID_CANDIDATES) if lexical else k
+            vectors = await self.aembed_queries([queries[key] for key in needs_vectors])
+            rows = await asyncio.to_thread(self.index.search_rows, vectors, depth, filter)
+            vector_rows = dict(zip(needs_vectors, rows))
+        return self._fuse(keys, k, lexical, vector_rows)
+
+    def _cached_results(self, keys, k, mode, filter):
+        """Looks up cached chunks per distinct query; returns them and the queries still to retrieve."""
+        results = {}
+        for key in dict.fromkeys(keys):
+            # Results are only valid for the index they came from, so its version is part of the key
+            docs = self.retrieval_cache.get((key, k, mode, filter_key(filter), self.index.version))
+            if docs is not None:
+                results[key] = docs
+        return results, [key for key in dict.fromkeys(keys) if key not in results]
+
+    @staticmethod
+    def _first_texts(keys, queries, pending):
+        """{normalized query: its first original spelling} for the queries still to retrieve."""
+        texts = {}
+        for key, query in zip(keys, queries):
+            texts.setdefault(key, query)
+        return {key: texts[key] for key in pending}
+
+    def _store_results(self, results, pending, rows_per_query, k, mode, filter):
+        for key, rows in zip(pending, rows_per_query):
+            docs = [self.index.chunk_document(row) for row in rows]
+            self.retrieval_cache.put((key, k, mode, filter_key(filter), self.index.version), docs)
+            results[key] = docs
+
+    def retrieve(self, query, k=5, mode=None, filter=None):
+        """
+        Retrieves the top k most relevant chunks for a given query, fusing BM25 and FAISS
+        rankings according to the retrieval mode (the pipeline's default if `mode` is None).
+        An optional metadata `filter` such as {"agreement_type": "license"} restricts the
+        search to matching contracts (see contract_metadata.matches_filter).
+        """
+        return self.retrieve_many([query], k, mode, filter)[0]
+
+    def retrieve_many(self, queries, k=5, mode=None, filter=None):
+        """
+        Retrieves the top k chunks for several queries at once. Duplicate queries are handled
+        once, every uncached query that needs a vector is embedded in a single request, and all
+        of them are searched with one batched FAISS call. Returns one list of chunks per query.
+        """
+        mode = mode or self.retrieval_mode
+        keys = [normalize_query(query) for query in queries]
+        results, pending = self._cached_results(keys, k, mode, filter)
+        if pending:
+            texts = self._first_texts(keys, queries, pending)
+            self._store_results(results, pending, self._retrieve_rows(texts, k, mode, filter), k, mode, filter)
+        return [list(results[key]) for key in keys]
+
+    async def aretrieve(self, query, k=5, mode=None, filter=None):
+        """Async counterpart of retrieve; never blocks the event loop on the network or on FAISS."""
+        return (await self.aretrieve_many([query], k, mode, filter))[0]
+
+    async def aretrieve_many(self, queries, k=5, mode=None, filter=None):
+        """Async counterpart of retrieve_many."""
+        mode = mode or self.retrieval_mode
+        keys = [normalize_query(query) for query in queries]
+        results, pending = self._cached_results(keys, k, mode, filter)
+        if pending:
+            rows_per_query = await self._aretrieve_rows(self._first_texts(keys, queries, pending), k, mode, filter)
+            # Building the chunk documents reads chunk text from the memory-mapped index
+            await asyncio.to_thread(self._store_results, results, pending, rows_per_query, k, mode, filter)
+        return [list(results[key]) for key in keys]
+
+    def classify_vectors(self, vectors):
+        """Embedding-based categories and similarities for a batch of vectors (see clause_classifier.py)."""
+        return self.classifier.classify(vectors)
+
+    async def aclassify(self, query, retrieved_chunks):
+        """
+        Embedding-based category of a request, from the stored vectors of the chunks retrieved
+        for it, together with its query vector when retrieval already embedded the query (the
+        lexical fast path does not, and classification never embeds on its own). Returns None
+        when the index has no centroids or there is nothing to classify.
+        """
+        if self.classifier is None:
+            return None
+        vector = self.query_embedding_cache.get(normalize_query(query))
+        rows = [doc.metadata["row"] for doc in retrieved_chunks if doc.metadata.get("row") is not None]
+        vectors = await asyncio.to_thread(self.index.chunk_vectors, rows)
+        if vector is not None:
+            vectors = np.vstack([np.asarray(vector, dtype=np.float32)[None, :], vectors])
+        if not len(vectors):
+            return None
+        return self.classifier.classify_together(vectors)
+
+    def cache_stats(self):
+        """Hit/miss counters of the pipeline's caches, and the state of the LLM queue."""
+        with self._paths_lock:
+            retrieval_paths = dict(self.retrieval_paths)
+        return {
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "retrieval": self.retrieval_cache.stats(),
+            "retrieval_paths": retrieval_paths,
+            "llm": self.llm_limiter.stats(),
+            "providers": llm_providers.stats(),
+            "responses": self.response_cache.stats(),
+            "exact_responses": self.exact_response_cache.stats(),
+        }
+
+    def build_prompt(self, query, retrieved_chunks):
+        """
+        Builds the clause-drafting prompt from the user's query and retrieved chunks. The chunks
+        are packed into at most `context_token_budget` tokens: overlapping neighbours are merged,
+        near-duplicates dropped and the best-ranked passages kept (see context_packing.py).
+        """
+        prompt = f"**User Intent:** {query}\n\n**Examples:**\n"
+
+        for i, passage in enumerate(pack_context(retrieved_chunks, self.context_token_budget)):
+            prompt += f"{i+1}. {passage.text}\n\n"
 
         prompt += """
 **Instructions:**
@@ -51,11 +327,79 @@ class RAGPipeline:
 - Do not give irrelevant references or contexts which are not related to the prompt/topic or arent covered in the corpus.
 - Attribute any borrowed language or structure from retrieved examples by noting “[Adapted from Example X]” in brackets.
 """
+        return prompt
 
+    def generate(self, query, retrieved_chunks):
+        """Generates a new clause using the user's query and retrieved chunks."""
+        response = self.llm.invoke([HumanMessage(content=self.build_prompt(query, retrieved_chunks))])
+        return response.content
 
-        response = self.llm.invoke([HumanMessage(content=prompt)])
+    async def agenerate(self, query, retrieved_chunks):
+        """
+        Async counterpart of generate. At most LLM_MAX_CONCURRENCY calls are outstanding;
+        raises concurrency.QueueFullError when LLM_MAX_QUEUE more are already waiting.
+        """
+        async with self.llm_limiter.slot():
+            response = await self.llm.ainvoke([HumanMessage(content=self.build_prompt(query, retrieved_chunks))])
         return response.content
 
+    async def astream_generate(self, query, retrieved_chunks):
+        """Like agenerate, but yields the clause text piece by piece as the LLM produces it."""
+        async with self.llm_limiter.slot():
+            async for chunk in self.llm.astream([HumanMessage(content=self.build_prompt(query, retrieved_chunks))]):
+                if chunk.content:
+                    yield chunk.content
+
+    def build_document_prompt(self, question, passages):
+        """Builds the prompt for answering a question about an uploaded document from its best-matching passages."""
+        prompt = f"**Question:** {question}\n\n**Passages from the document:**\n"
+        for passage in passages:
+            pages = f"p. {passage.first_page}" if passage.first_page == passage.last_page else f"pp. {passage.first_page}-{passage.last_page}"
+            prompt += f"[{pages}] {passage.text}\n\n"
+
+        prompt += """
+**Instructions:**
+- Answer the question using only the passages above.
+- Cite the pages your answer relies on, e.g. "(p. 3)".
+- If the passages do not answer the question, say so instead of guessing.
+"""
+        return prompt
+
+    async def aanswer_document(self, question, passages):
+        """Answers a question from passages of an uploaded document; limited like agenerate."""
+        async with self.llm_limiter.slot():
+            response = await self.llm.ainvoke([HumanMessage(content=self.build_document_prompt(question, passages))])
+        return response.content
+
+    def chunk_ids(self, retrieved_chunks):
+        """Identifies retrieved chunks across calls; ids from an older index never match."""
+        return {(self.index.version, doc.metadata.get("row")) for doc in retrieved_chunks}
+
+    def cached_response(self, query, retrieved_chunks):
+        """
+        Returns the response stored for an earlier query grounded in the same chunks, or None.
+        Never embeds: a query whose vector is already in the query cache (because retrieval
+        needed it) is matched semantically against earlier paraphrases; any query, including
+        one answered by the lexical fast path, also matches its own normalized text exactly.
+        """
+        key = normalize_query(query)
+        chunk_ids = frozenset(self.chunk_ids(retrieved_chunks))
+        response = self.exact_response_cache.get((key, chunk_ids))
+        if response is None:
+            vector = self.query_embedding_cache.get(key)
+            if vector is not None:
+                response = self.response_cache.get(vector, chunk_ids)
+        return response
+
+    def cache_response(self, query, retrieved_chunks, response):
+        """Stores a generated response (clause, risk, classification, ...) for repeats and later paraphrases."""
+        key = normalize_query(query)
+        chunk_ids = frozenset(self.chunk_ids(retrieved_chunks))
+        self.exact_response_cache.put((key, chunk_ids), response)
+        vector = self.query_embedding_cache.get(key)
+        if vector is not None:
+            self.response_cache.put(vector, chunk_ids, response)
+
     def get_metadata_and_source(self, retrieved_chunks):
         if not retrieved_chunks:
             return None, None
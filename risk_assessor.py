@@ -1,51 +1,130 @@
 import re
+from collections import Counter, namedtuple
+
+# --- Keyword Sets ---
+# Simplified models that should be expanded for real-world use.
+RISK_KEYWORDS = {
+    "High": ['termination for convenience', 'unlimited liability', 'indemnify', 'liquidated damages'],
+    "Medium": ['confidentiality', 'non-disclosure', 'warranty', 'limitation of liability'],
+}
+CLASSIFICATION_KEYWORDS = {
+    "Termination": ['terminate', 'termination'],
+    "Confidentiality": ['confidential', 'non-disclosure'],
+    "Liability": ['liability', 'indemnify'],
+    "Payment": ['payment', 'fee', 'invoice'],
+}
+RISK_LEVELS = {
+    "Low": 1,
+    "Medium": 2,
+    "High": 3,
+    "Very High": 4 # Added Very High for completeness, though not explicitly used in assess_risk yet
+}
+DEFAULT_RISK = "Low"
+DEFAULT_CLASSIFICATION = "General"
+
+# One keyword found in a clause: `kind` is "risk" or "category", `label` the risk level or
+# category it stands for, and [start, end) its character span in the clause
+Match = namedtuple("Match", ["kind", "label", "keyword", "start", "end"])
+
+
+def _compile(keyword_sets):
+    """
+    Compiles every keyword into one alternation over lowercase text, longest first, so a
+    clause is scanned once for all of them. Each keyword is its own capturing group, so a
+    match identifies its keyword by group number even when the matched text is spelled
+    differently (a case-insensitive scan matches "ſ" for "s"). Matches cannot overlap, so
+    each keyword also records the other keywords it contains as whole words ("limitation of
+    liability" contains the Liability keyword "liability") with their offset inside it; the
+    returned list holds these per group, in group order.
+    """
+    keywords = {keyword for _, labels in keyword_sets for words in labels.values() for keyword in words}
+    terms = sorted(keywords, key=lambda term: (-len(term), term))
+    hits = [
+        [
+            (kind, label, keyword, found.start())
+            for kind, labels in keyword_sets
+            for label, words in labels.items()
+            for keyword in words
+            for found in re.finditer(r"\b" + re.escape(keyword) + r"\b", term)
+        ]
+        for term in terms
+    ]
+    alternatives = "|".join("(" + re.escape(term) + ")" for term in terms)
+    return re.compile(r"\b(?:" + alternatives + r")\b"), hits
+
+
+KEYWORD_RE, TERM_HITS = _compile((("risk", RISK_KEYWORDS), ("category", CLASSIFICATION_KEYWORDS)))
+# For the rare text whose lowercase form has a different length, so spans would shift
+KEYWORD_RE_ANY_CASE = re.compile(KEYWORD_RE.pattern, re.IGNORECASE)
+
 
 class RiskAssessor:
+    def find_matches(self, clause: str) -> list:
+        """Every risk term and category keyword in a clause, with its span, in order of appearance."""
+        # Lowercasing first is about three times faster than a case-insensitive scan
+        lowered = clause.lower()
+        text, pattern = (lowered, KEYWORD_RE) if len(lowered) == len(clause) else (clause, KEYWORD_RE_ANY_CASE)
+        matches = []
+        for found in pattern.finditer(text):
+            for kind, label, keyword, offset in TERM_HITS[found.lastindex - 1]:
+                start = found.start() + offset
+                matches.append(Match(kind, label, keyword, start, start + len(keyword)))
+        return matches
+
+    @staticmethod
+    def _risk(matches) -> str:
+        levels = [match.label for match in matches if match.kind == "risk"]
+        return max(levels, key=RISK_LEVELS.get) if levels else DEFAULT_RISK
+
+    @staticmethod
+    def _classification(matches) -> str:
+        """The category with the most keyword hits; ties go to the one mentioned first."""
+        counts = Counter(match.label for match in matches if match.kind == "category")
+        if not counts:
+            return DEFAULT_CLASSIFICATION
+        first_seen = {}
+        for match in matches:
+            first_seen.setdefault(match.label, match.start)
+        return min(counts, key=lambda label: (-counts[label], first_seen[label]))
+
     def assess_risk(self, clause: str) -> str:
         """
-        Assesses the risk of a clause based on keywords.
-        This is a simplified model and should be expanded for real-world use.
+        Assesses the risk of a clause based on keywords: the highest level any of its
+        risk terms stands for, or Low.
         """
-        high_risk_keywords = ['termination for convenience', 'unlimited liability', 'indemnify', 'liquidated damages']
-        medium_risk_keywords = ['confidentiality', 'non-disclosure', 'warranty', 'limitation of liability']
-        
-        clause_lower = clause.lower()
-        
-        if any(re.search(r'\b' + keyword + r'\b', clause_lower) for keyword in high_risk_keywords):
-            return "High"
-        elif any(re.search(r'\b' + keyword + r'\b', clause_lower) for keyword in medium_risk_keywords):
-            return "Medium"
-        else:
-            return "Low"
+        return self._risk(self.find_matches(clause))
 
     def classify_clause(self, clause: str) -> str:
         """
-        Classifies a clause based on keywords.
-        This is a simplified model and should be expanded for real-world use.
+        Classifies a clause based on keywords: the category most of its keywords belong
+        to, or General.
         """
-        classification_keywords = {
-            "Termination": ['terminate', 'termination'],
-            "Confidentiality": ['confidential', 'non-disclosure'],
-            "Liability": ['liability', 'indemnify'],
-            "Payment": ['payment', 'fee', 'invoice']
+        return self._classification(self.find_matches(clause))
+
+    def analyze(self, clause: str) -> dict:
+        """Risk, classification, every matched category and every match, from a single scan."""
+        matches = self.find_matches(clause)
+        return {
+            "risk": self._risk(matches),
+            "classification": self._classification(matches),
+            "categories": sorted({match.label for match in matches if match.kind == "category"}),
+            "matches": matches,
         }
-        
-        clause_lower = clause.lower()
-        
-        for classification, keywords in classification_keywords.items():
-            if any(re.search(r'\b' + keyword + r'\b', clause_lower) for keyword in keywords):
-                return classification
-        
-        return "General"
+
+    def assess_many(self, clauses) -> list:
+        """assess_risk for every clause of a batch (e.g. all clauses of a document)."""
+        return [self._risk(self.find_matches(clause)) for clause in clauses]
+
+    def classify_many(self, clauses) -> list:
+        """classify_clause for every clause of a batch."""
+        return [self._classification(self.find_matches(clause)) for clause in clauses]
+
+    def analyze_many(self, clauses) -> list:
+        """analyze for every clause of a batch."""
+        return [self.analyze(clause) for clause in clauses]
 
     def get_risk_level_value(self, risk: str) -> int:
         """
         Returns a numerical value for a given risk level for comparison.
         """
-        risk_map = {
-            "Low": 1,
-            "Medium": 2,
-            "High": 3,
-            "Very High": 4 # Added Very High for completeness, though not explicitly used in assess_risk yet
-        }
-        return risk_map.get(risk, 99) # Default to a high value for unknown risks
+        return RISK_LEVELS.get(risk, 99) # Default to a high value for unknown risks
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+import contract_metadata
+from risk_assessor import CLASSIFICATION_KEYWORDS, DEFAULT_CLASSIFICATION, RISK_KEYWORDS, RISK_LEVELS
+
+# --- On-Disk Layout ---
+# CURRENT         name of the version folder holding the current profile; replaced atomically
+#                 once a new version is complete, so readers never mix files of two saves
+# v-<time>/       one saved profile (the current one and the one before it are kept):
+# profile.json    labels behind the category/risk codes, the settings the profile was built with,
+#                 and per-file name, source, sha256 and metadata (see contract_metadata.py)
+# <column>.npy    one value per clause, all in the same order (memory-mapped on load):
+#   file_id       index into profile.json's files
+#   offset        character offset of the clause in its file's text
+#   length        clause length in characters
+#   category      code of the clause's classification (RiskAssessor.classify_clause)
+#   categories    bitmask of every category any of its keywords belong to (General if none)
+#   risk          code of its risk level (RiskAssessor.assess_risk)
+RISK_PROFILE_PATH = "risk_profile"
+PROFILE_FILENAME = "profile.json"
+POINTER_FILENAME = "CURRENT"
+VERSIONS_KEPT = 2  # The previous version stays for readers that resolved CURRENT just before a save
+COLUMN_DTYPES = {
+    "file_id": np.uint32,
+    "offset": np.uint32,
+    "length": np.uint32,
+    "category": np.uint8,
+    "categories": np.uint8,
+    "risk": np.uint8,
+}
+CATEGORIES = tuple(CLASSIFICATION_KEYWORDS) + (DEFAULT_CLASSIFICATION,)
+RISKS = tuple(sorted(RISK_LEVELS, key=RISK_LEVELS.get))
+MAX_QUERY_LIMIT = 1000
+
+
+def keyword_signature():
+    """Changes whenever the keyword sets do, so stale profiles are rebuilt rather than reused."""
+    keywords = json.dumps([RISK_KEYWORDS, CLASSIFICATION_KEYWORDS], sort_keys=True)
+    return hashlib.sha256(keywords.encode("utf-8")).hexdigest()[:16]
+
+
+def category_mask(categories):
+    """Bitmask of a set of category labels."""
+    return sum(1 << CATEGORIES.index(category) for category in categories)
+
+
+def empty_columns():
+    return {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+
+
+def save_profile(path, files, columns, settings):
+    """
+    Writes a profile into a new version folder and then points CURRENT at it, so a reader
+    sees either the old profile or the new one in full. Older versions are removed.
+    """
+    path = Path(path)
+    version = f"v-{time.time_ns():x}"
+    version_path = path / version
+    version_path.mkdir(parents=True)
+    for name, dtype in COLUMN_DTYPES.items():
+        with open(version_path / f"{name}.npy", "wb") as f:
+            np.save(f, np.ascontiguousarray(columns[name], dtype=dtype))
+    with open(version_path / PROFILE_FILENAME, "w", encoding="utf-8") as f:
+        json.dump({"categories": CATEGORIES, "risks": RISKS, "settings": settings, "files": files}, f)
+
+    tmp_path = path / (POINTER_FILENAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, path / POINTER_FILENAME)
+
+    versions = sorted(p.name for p in path.glob("v-*") if p.is_dir())
+    for old in versions[:-VERSIONS_KEPT]:
+        shutil.rmtree(path / old, ignore_errors=True)
+    # Files of the layout before version folders existed
+    for name in [PROFILE_FILENAME] + [f"{name}.npy" for name in COLUMN_DTYPES]:
+        (path / name).unlink(missing_ok=True)
+
+
+def current_folder(path=RISK_PROFILE_PATH):
+    """The folder holding the current profile, or None if there is none."""
+    path = Path(path)
+    try:
+        with open(path / POINTER_FILENAME, "r", encoding="utf-8") as f:
+            return path / f.read().strip()
+    except FileNotFoundError:
+        # Profiles saved before version folders keep their files at the top level
+        return path if (path / PROFILE_FILENAME).exists() else None
+
+
+class RiskProfile:
+    """
+    Read-only, columnar store of per-clause risk results for a whole corpus, written by
+    build_risk_profile.py. Queries are vectorized over the memory-mapped columns.
+    """
+
+    def __init__(self, columns, files, categories, risks, settings=None, version=None):
+        self.columns = columns
+        self.files = files
+        self.categories = tuple(categories)
+        self.risks = tuple(risks)
+        self.settings = settings or {}
+        self.version = version
+
+    @classmethod
+    def load(cls, path=RISK_PROFILE_PATH, mmap=True):
+        folder = current_folder(path)
+        if folder is None:
+            raise FileNotFoundError(f"No risk profile found at {path}.")
+        with open(folder / PROFILE_FILENAME, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+        columns = {name: np.load(folder / f"{name}.npy", mmap_mode="r" if mmap else None) for name in COLUMN_DTYPES}
+        return cls(
+            columns, profile["files"], profile["categories"], profile["risks"], profile.get("settings"),
+            version=cls._folder_version(folder),
+        )
+
+    @classmethod
+    def exists(cls, path=RISK_PROFILE_PATH):
+        folder = current_folder(path)
+        return folder is not None and (folder / PROFILE_FILENAME).exists() and all(
+            (folder / f"{name}.npy").exists() for name in COLUMN_DTYPES
+        )
+
+    @classmethod
+    def current_version(cls, path=RISK_PROFILE_PATH):
+        """Identifies the saved profile; changes on every save."""
+        return cls._folder_version(current_folder(path))
+
+    @staticmethod
+    def _folder_version(folder):
+        stat = os.stat(folder / PROFILE_FILENAME)
+        return f"{folder.name}.{stat.st_mtime_ns:x}.{stat.st_size:x}"
+
+    def __len__(self):
+        return len(self.columns["file_id"])
+
+    # --- Filters ---
+
+    def _codes(self, values, labels, kind):
+        """Codes of one label or a list of them; raises ValueError for unknown ones."""
+        values = [values] if isinstance(values, str) else values
+        by_name = {label.casefold(): code for code, label in enumerate(labels)}
+        codes = []
+        for value in values:
+            if value.casefold() not in by_name:
+                raise ValueError(f"Unknown {kind} '{value}'. Choose from {', '.join(labels)}.")
+            codes.append(by_name[value.casefold()])
+        return codes
+
+    def file_mask(self, filter=None):
+        """Which files pass a contract_metadata filter (agreement type, filer, dates)."""
+        if not filter:
+            return np.ones(len(self.files), dtype=bool)
+        return np.array([contract_metadata.matches_filter(f["metadata"], filter) for f in self.files], dtype=bool)
+
+    def clause_mask(self, risk=None, category=None, filter=None):
+        """
+        Which clauses have one of the `risk` levels, mention one of the `category` labels
+        (not only as their main classification) and belong to a file passing `filter`.
+        """
+        mask = self.file_mask(filter)[self.columns["file_id"]]
+        if risk:
+            mask &= np.isin(self.columns["risk"], self._codes(risk, self.risks, "risk level"))
+        if category:
+            bits = sum(1 << code for code in self._codes(category, self.categories, "category"))
+            mask &= (self.columns["categories"] & bits) != 0
+        return mask
+
+    # --- Queries ---
+
+    def _clause(self, row):
+        file_info = self.files[int(self.columns["file_id"][row])]
+        bits = int(self.columns["categories"][row])
+        return {
+            "contract": file_info["name"],
+            "agreement_type": file_info["metadata"]["agreement_type"],
+            "offset": int(self.columns["offset"][row]),
+            "length": int(self.columns["length"][row]),
+            "category": self.categories[int(self.columns["category"][row])],
+            "categories": [label for code, label in enumerate(self.categories) if bits >> code & 1],
+            "risk": self.risks[int(self.columns["risk"][row])],
+        }
+
+    def query(self, risk=None, category=None, filter=None, limit=100, offset=0):
+        """
+        Clauses matching the given risk levels, categories and contract filter, in corpus
+        order. Returns the total number of matches and one page of them.
+        """
+        rows = np.flatnonzero(self.clause_mask(risk, category, filter))
+        page = rows[offset:offset + min(limit, MAX_QUERY_LIMIT)]
+        return int(len(rows)), [self._clause(row) for row in page]
+
+    def contract_summaries(self, risk=None, category=None, filter=None, limit=100, offset=0):
+        """
+        Per-contract profile: clause counts by risk level and by category, counting only
+        clauses that match `risk` and `category`. Contracts with the most high-risk clauses
+        come first. Returns the total number of contracts and one page of them.
+        """
+        mask = self.clause_mask(risk, category, filter)
+        file_ids = self.columns["file_id"][mask]
+        by_risk = np.zeros((len(self.files), len(self.risks)), dtype=np.int64)
+        np.add.at(by_risk, (file_ids, self.columns["risk"][mask]), 1)
+        by_category = np.zeros((len(self.files), len(self.categories)), dtype=np.int64)
+        bits = self.columns["categories"][mask]
+        for code in range(len(self.categories)):
+            by_category[:, code] = np.bincount(file_ids, weights=(bits >> code) & 1, minlength=len(self.files))
+
+        selected = np.flatnonzero(self.file_mask(filter) & (by_risk.sum(axis=1) > 0 if (risk or category) else True))
+        # Most severe first: sort on the count of each level, highest level first
+        order = np.lexsort(tuple(-by_risk[selected, code] for code in range(len(self.risks))))
+        selected = selected[order]
+        page = selected[offset:offset + min(limit, MAX_QUERY_LIMIT)]
+        return int(len(selected)), [
+            {
+                "contract": self.files[file_id]["name"],
+                **self.files[file_id]["metadata"],
+                "clauses": int(by_risk[file_id].sum()),
+                "risk": {label: int(by_risk[file_id, code]) for code, label in enumerate(self.risks)},
+                "categories": {label: int(by_category[file_id, code]) for code, label in enumerate(self.categories)},
+            }
+            for file_id in page
+        ]
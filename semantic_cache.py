@@ -0,0 +1,119 @@
+import time
+import threading
+
+import numpy as np
+
+SAME_QUERY_SIMILARITY = 0.999  # Cosine similarity above which two stored queries count as the same
+
+
+class SemanticCache:
+    """
+    Cache keyed by meaning rather than exact text. Each entry holds a query embedding, the
+    ids of the chunks retrieved for it and a value. A lookup hits when a stored query is
+    within `threshold` cosine similarity of the new one *and* at least `min_overlap` of the
+    new query's retrieved chunks were also retrieved for it, so paraphrases share an answer
+    but similar-sounding questions grounded in different clauses do not.
+
+    Embeddings live in one preallocated matrix, so a lookup is a single matrix-vector
+    product. Entries expire `ttl` seconds after they are stored, and the least recently
+    used entry is replaced once `maxsize` are held. Thread-safe.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600.0, threshold: float = 0.93, min_overlap: float = 0.6):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self._vectors = None  # (maxsize, dim) unit vectors, allocated on the first put
+        self._entries = [None] * maxsize  # (chunk id set, value, expires_at) per slot
+        self._last_used = np.zeros(maxsize, dtype=np.float64)  # 0 marks a free slot
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def overlap(chunk_ids, cached_ids):
+        """Share of `chunk_ids` that also appear in `cached_ids`."""
+        return len(chunk_ids & cached_ids) / len(chunk_ids) if chunk_ids else 0.0
+
+    def get(self, vector, chunk_ids):
+        """Returns the value of the most similar matching entry, or None."""
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            if self._vectors is None or not self.maxsize:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            similarities = self._vectors @ self._unit(vector)
+            candidates = np.flatnonzero((similarities >= self.threshold) & (self._last_used > 0))
+            for slot in candidates[np.argsort(-similarities[candidates])]:
+                cached_ids, value, expires_at = self._entries[slot]
+                if expires_at <= now:
+                    self._free(slot)
+                    continue
+                if self.overlap(chunk_ids, cached_ids) >= self.min_overlap:
+                    self._last_used[slot] = now
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, vector, chunk_ids, value):
+        """Stores a value; an entry for the same query and chunks (e.g. a regenerated answer) is replaced."""
+        if not self.maxsize:
+            return
+        vector = self._unit(vector)
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+            same = [
+                slot for slot in np.flatnonzero((self._vectors @ vector >= SAME_QUERY_SIMILARITY) & (self._last_used > 0))
+                if self._entries[slot][0] == chunk_ids
+            ]
+            free = np.flatnonzero(self._last_used == 0)
+            if same:
+                slot = same[0]
+            elif len(free):
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            now = time.monotonic()
+            self._vectors[slot] = vector
+            self._entries[slot] = (chunk_ids, value, now + self.ttl)
+            self._last_used[slot] = now
+
+    def _free(self, slot):
+        self._vectors[slot] = 0
+        self._entries[slot] = None
+        self._last_used[slot] = 0
+
+    def clear(self):
+        with self._lock:
+            for slot in np.flatnonzero(self._last_used > 0):
+                self._free(slot)
+
+    def __len__(self):
+        return int((self._last_used > 0).sum())
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self),
+                "maxsize": self.maxsize,
+                "threshold": self.threshold,
+                "min_overlap": self.min_overlap,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
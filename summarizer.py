@@ -0,0 +1,138 @@
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+from collections import namedtuple
+
+from langchain_core.messages import HumanMessage
+
+import chunker
+
+logger = logging.getLogger(__name__)
+
+# --- Summarizer Settings ---
+# Long documents are summarized hierarchically: the text is split on section boundaries, the
+# pieces are summarized in parallel (map) and the partial summaries are merged a group at a
+# time until one is left (reduce). Each prompt stays far below the model's context window.
+SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", "4000"))  # Characters per map prompt (~1k tokens)
+# Chunks grow past SUMMARY_CHUNK_SIZE to keep a document to about SUMMARY_MAX_MAP_CHUNKS of them,
+# but never past SUMMARY_MAX_CHUNK_SIZE (~3k tokens, inside Ollama's default 4k context)
+SUMMARY_MAX_CHUNK_SIZE = int(os.getenv("SUMMARY_MAX_CHUNK_SIZE", "12000"))
+SUMMARY_MAX_MAP_CHUNKS = int(os.getenv("SUMMARY_MAX_MAP_CHUNKS", "48"))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "8"))  # Summary calls in flight per document
+SUMMARY_REDUCE_FANIN = int(os.getenv("SUMMARY_REDUCE_FANIN", "8"))  # Partial summaries merged per reduce call
+FALLBACK_SENTENCES = 3  # Sentences kept from a piece whose summary call failed
+
+MAP_PROMPT = (
+    "Summarize part {part} of {parts} of a contract in a few sentences. Keep the parties, obligations, "
+    "amounts, dates, termination rights and liabilities it mentions.\n\nText:\n{text}\n\nSummary:"
+)
+REDUCE_PROMPT = (
+    "These are summaries of consecutive parts of one contract. Merge them into a single summary that "
+    "keeps every important party, obligation, amount, date, termination right and liability.\n\n"
+    "Summaries:\n{text}\n\nMerged summary:"
+)
+FINAL_PROMPT = "Summarize this text in a clear and concise way: {text}"
+
+# Result of summarize: the summary, seconds spent per stage (split, map, reduce, total), and
+# the number of map chunks, summary calls, reduce passes and calls that failed
+Summary = namedtuple("Summary", ["text", "timings", "chunks", "calls", "reduce_passes", "failed"])
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def lead_sentences(text, count=FALLBACK_SENTENCES):
+    """The first few sentences of a text, as a stand-in when it could not be summarized."""
+    sentences = SENTENCE_END_RE.split(text.strip(), maxsplit=count)
+    return " ".join(sentences[:count]) + ("..." if len(sentences) > count else "")
+
+
+def chunk_size_for(length, chunk_size=SUMMARY_CHUNK_SIZE, max_chunks=SUMMARY_MAX_MAP_CHUNKS,
+                   max_chunk_size=SUMMARY_MAX_CHUNK_SIZE):
+    """
+    Map chunk size for a text of `length` characters. Past `max_chunks` chunks the size grows,
+    so the number of map rounds (and with it the latency) stops growing with the page count
+    until chunks reach `max_chunk_size`.
+    """
+    return min(max(chunk_size, math.ceil(length / max_chunks)), max(chunk_size, max_chunk_size))
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes documents of any length with a chat model. At most `concurrency` summary calls
+    are in flight at once; the map stage takes about ceil(chunks / concurrency) call latencies
+    and the reduce stage one per pass, log_fanin(chunks) passes in all. Since chunks grow with
+    the document up to `max_chunk_size`, latency stays flat up to about max_chunks *
+    max_chunk_size characters (roughly 150-200 pages) and only grows slowly past that. A call that fails
+    (after the transport's own retries) is replaced by the lead sentences of its input, so one
+    bad call costs detail rather than the whole summary.
+    """
+
+    def __init__(self, model, chunk_size=SUMMARY_CHUNK_SIZE, max_chunks=SUMMARY_MAX_MAP_CHUNKS,
+                 max_chunk_size=SUMMARY_MAX_CHUNK_SIZE, concurrency=SUMMARY_MAP_CONCURRENCY, fanin=SUMMARY_REDUCE_FANIN):
+        if fanin < 2:
+            raise ValueError(f"fanin must be at least 2, got {fanin}.")
+        self.model = model
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.max_chunk_size = max_chunk_size
+        self.concurrency = concurrency
+        self.fanin = fanin
+
+    def split(self, text):
+        """Section-aware map chunks of a document, without overlap."""
+        size = chunk_size_for(len(text), self.chunk_size, self.max_chunks, self.max_chunk_size)
+        return chunker.split_text(text, size, 0)
+
+    async def _call(self, semaphore, prompt, fallback_text, failures):
+        async with semaphore:
+            try:
+                response = await self.model.ainvoke([HumanMessage(content=prompt)])
+                return response.content.strip()
+            except Exception as e:
+                logger.warning(f"Summary call failed ({e}); using the lead sentences of its input instead.")
+                failures.append(e)
+                return lead_sentences(fallback_text)
+
+    async def _reduce(self, semaphore, group, failures):
+        if len(group) == 1:  # A leftover partial summary goes on to the next pass as it is
+            return group[0]
+        text = "\n\n".join(group)
+        return await self._call(semaphore, REDUCE_PROMPT.format(text=text), text, failures)
+
+    async def summarize(self, text) -> Summary:
+        """Summarizes a document, splitting it and merging partial summaries as needed."""
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failures = []
+        chunks = self.split(text)
+        split_done = time.perf_counter()
+        if not chunks:
+            return Summary("", {"split": split_done - start, "map": 0.0, "reduce": 0.0, "total": split_done - start}, 0, 0, 0, 0)
+
+        # Map: a document that fits one chunk is summarized directly
+        if len(chunks) == 1:
+            prompts = [FINAL_PROMPT.format(text=chunks[0])]
+        else:
+            prompts = [MAP_PROMPT.format(part=i + 1, parts=len(chunks), text=chunk) for i, chunk in enumerate(chunks)]
+        partials = await asyncio.gather(*(self._call(semaphore, p, c, failures) for p, c in zip(prompts, chunks)))
+        calls = len(prompts)
+        map_done = time.perf_counter()
+
+        # Reduce: merge `fanin` consecutive partial summaries per call until one is left
+        passes = 0
+        while len(partials) > 1:
+            groups = [partials[i:i + self.fanin] for i in range(0, len(partials), self.fanin)]
+            partials = await asyncio.gather(*(self._reduce(semaphore, group, failures) for group in groups))
+            calls += sum(len(group) > 1 for group in groups)
+            passes += 1
+        end = time.perf_counter()
+
+        timings = {"split": split_done - start, "map": map_done - split_done, "reduce": end - map_done, "total": end - start}
+        logger.info(
+            f"Summarized {len(text)} characters in {timings['total']:.2f}s: {len(chunks)} chunks, {calls} calls, "
+            f"{passes} reduce passes, {len(failures)} failed (map {timings['map']:.2f}s, reduce {timings['reduce']:.2f}s)."
+        )
+        return Summary(partials[0], timings, len(chunks), calls, passes, len(failures))
@@ -0,0 +1,28 @@
+from risk_assessor import Match, RiskAssessor
+
+
+def test_matches_spans_in_lowercase_text():
+    matches = RiskAssessor().find_matches("Limitation of Liability applies.")
+    assert matches == [
+        Match("risk", "Medium", "limitation of liability", 0, 23),
+        Match("category", "Liability", "liability", 14, 23),
+    ]
+
+
+def test_case_insensitive_fallback_matches_other_spellings():
+    # "İ" lowercases to two characters, so the clause is scanned case-insensitively, where
+    # the long s "ſ" matches "s"; the keyword must still be found rather than raise KeyError
+    analysis = RiskAssessor().analyze("İ Non-discloſure obligations")
+    assert analysis["risk"] == "Medium"
+    assert analysis["classification"] == "Confidentiality"
+    assert [(match.keyword, match.start, match.end) for match in analysis["matches"]] == [
+        ("non-disclosure", 2, 16),
+        ("non-disclosure", 2, 16),
+    ]
+
+
+def test_case_insensitive_fallback_keeps_original_spans():
+    clause = "İ Termination for Convenience"
+    matches = RiskAssessor().find_matches(clause)
+    assert {match.keyword for match in matches} == {"termination for convenience", "termination"}
+    assert all(clause[match.start:match.end].lower() == match.keyword for match in matches)
@@ -0,0 +1,9 @@
+import numpy as np
+
+
+def unit_rows(vectors):
+    """Float32 matrix of the vectors (one or many) scaled to unit length; zero vectors stay zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors.reshape(-1, vectors.shape[-1])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
@@ -0,0 +1,85 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NotReadyError(RuntimeError):
+    """Raised when a request needs a component that has not finished loading (or failed to)."""
+
+    def __init__(self, name: str, state: str, retry_after: int, error: str = None):
+        detail = f"'{name}' is {state}" + (f": {error}" if error else "")
+        super().__init__(detail)
+        self.name = name
+        self.state = state
+        self.retry_after = retry_after
+        self.error = error
+
+
+class Component:
+    """
+    Something expensive the service needs (an index, a model client, heavy imports) that is
+    built by `factory` in a worker thread after startup instead of at import time, so the
+    process comes up at once and a missing key or index fails only the requests that need it.
+
+    Requests `await get()`, which waits up to `wait_timeout` seconds for loading to finish
+    and raises NotReadyError otherwise. A failed load is retried by the first request
+    arriving `retry_interval` seconds or more after the failure.
+    """
+
+    def __init__(self, name: str, factory, wait_timeout: float = 10.0, retry_interval: float = 30.0, retry_after: int = 5):
+        self.name = name
+        self.factory = factory
+        self.wait_timeout = wait_timeout
+        self.retry_interval = retry_interval
+        self.retry_after = retry_after
+        self.state = "pending"  # pending -> loading -> ready | failed
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self._failed_at = None
+        self._task = None
+
+    def start(self):
+        """Schedules loading on the running event loop; does nothing if it is already underway."""
+        if self._task is None or (self._task.done() and self.state == "failed"):
+            self.state = "loading"
+            self._task = asyncio.get_running_loop().create_task(self._load())
+        return self._task
+
+    async def _load(self):
+        start = time.perf_counter()
+        try:
+            self.value = await asyncio.to_thread(self.factory)
+        except Exception as e:
+            self.state, self.error, self._failed_at = "failed", str(e), time.monotonic()
+            logger.error(f"❌ Failed to load {self.name}: {e}")
+            return
+        self.load_seconds = time.perf_counter() - start
+        self.state, self.error = "ready", None
+        logger.info(f"✅ {self.name} ready in {self.load_seconds:.2f}s")
+
+    async def get(self):
+        """Returns the loaded value, waiting for loading to finish if it is underway."""
+        if self.state == "ready":
+            return self.value
+        if self.state == "failed" and time.monotonic() - self._failed_at >= self.retry_interval:
+            logger.info(f"Retrying to load {self.name}...")
+            self.start()
+        if self.state != "failed":
+            try:
+                await asyncio.wait_for(asyncio.shield(self.start()), self.wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.state == "ready":
+            return self.value
+        raise NotReadyError(self.name, self.state, self.retry_after, self.error)
+
+    def status(self) -> dict:
+        status = {"state": self.state}
+        if self.load_seconds is not None:
+            status["load_seconds"] = round(self.load_seconds, 3)
+        if self.error:
+            status["error"] = self.error
+        return status